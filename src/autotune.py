@@ -0,0 +1,170 @@
+import json
+import os
+import platform
+import random
+import time
+
+import torch
+from torch import nn, optim
+from torch_geometric.loader import DataLoader
+
+from utils import train_graph, train_node
+from resources import AUTO_CANDIDATES, estimate_resources
+
+
+# Autotuner for the execution settings of the QGNN quantum layers. Settings are
+# tuned one at a time -- (backend, diff_method), chunk size, batch size, thread
+# count -- each by short timed trials of training passes (forward + backward)
+# over a sample of the real dataset, keeping the fastest value before moving on.
+# Configurations whose estimated (or, on CUDA, measured) peak memory exceeds the
+# cap are skipped. The result is cached per (dataset, model, graphlet_size,
+# layers, host), so later runs start with it right away.
+#
+# The backend and diff_method are only searched when left at their defaults or
+# with --backend auto; a backend chosen on the command line is kept (and is part
+# of the cache key). Bucketing granularity is only searched through chunk_size.
+
+CHUNK_SIZES = (None, 64, 256, 1024)
+TUNED = ('backend', 'diff_method', 'chunk_size', 'batch_size', 'threads')
+DEFAULT_BACKEND = ('pennylane', 'backprop')
+
+
+def searches_backend(args):
+    return args.backend == 'auto' or (args.backend, args.diff_method) == DEFAULT_BACKEND
+
+
+def host_id(device):
+    host = f"{platform.machine()}-{platform.processor() or 'cpu'}-{os.cpu_count()}"
+    if torch.device(device).type == 'cuda':
+        host += f"-{torch.cuda.get_device_name(device)}"
+    return host
+
+
+def cache_key(args, device):
+    parts = [args.dataset.upper(), args.task, args.model, f"graphlet{args.graphlet_size}",
+             f"gnn{args.num_gnn_layers}", f"ent{args.num_ent_layers}", host_id(device)]
+    if not searches_backend(args):
+        parts.append(f"{args.backend}-{args.diff_method}")
+    return '|'.join(parts)
+
+
+def load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(path, cache):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def time_trial(make_model, config, train_data, task, device, steps=2):
+    # Seconds per training pass over ``train_data``, after one warm-up pass
+    torch.set_num_threads(config['threads'])
+    model = make_model(config).to(device)
+    optimizer = optim.SGD(model.parameters(), lr=0.0)
+    criterion = nn.CrossEntropyLoss()
+    if task == 'graph':
+        loader = DataLoader(train_data, batch_size=config['batch_size'])
+        run = lambda: train_graph(model, optimizer, loader, criterion, device)
+    else:
+        run = lambda: train_node(model, optimizer, train_data, criterion, device)
+    if torch.device(device).type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    run()
+    start = time.perf_counter()
+    for _ in range(steps):
+        run()
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+    elapsed = (time.perf_counter() - start) / steps
+    peak = torch.cuda.max_memory_allocated(device) if torch.device(device).type == 'cuda' else None
+    return elapsed, peak
+
+
+def candidate_values(args, noisy):
+    if not searches_backend(args):
+        backends = [(args.backend, args.diff_method)]
+    else:
+        backends = [('statevector', 'backprop')] if noisy else list(AUTO_CANDIDATES)
+        if args.backend != 'auto' and (args.backend, args.diff_method) not in backends:
+            backends.insert(0, (args.backend, args.diff_method))
+    threads = sorted({1, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1})
+    batch_sizes = sorted({max(1, args.batch_size // 2), args.batch_size, 2 * args.batch_size})
+    return {'backend': backends, 'chunk_size': list(CHUNK_SIZES),
+            'batch_size': batch_sizes if args.task == 'graph' else [args.batch_size], 'threads': threads}
+
+
+def tune(args, make_model, w_shapes, train_data, device, budget, sample=64, steps=2, log=print):
+    """Fastest settings (dict over ``TUNED``) found by coordinate search within ``budget`` bytes (None = no cap)."""
+    noisy = args.depolarizing > 0 or args.damping > 0
+    graphs = list(train_data)[:sample] if args.task == 'graph' else [train_data]
+    trial_data = graphs if args.task == 'graph' else train_data
+    values = candidate_values(args, noisy)
+    best = {'backend': values['backend'][0][0], 'diff_method': values['backend'][0][1],
+            'chunk_size': args.chunk_size, 'batch_size': args.batch_size, 'threads': torch.get_num_threads()}
+    timings = {}
+
+    def measure(config):
+        key = tuple(config[name] for name in TUNED)
+        if key not in timings:
+            estimate = estimate_resources(w_shapes, graphs, [], config['batch_size'], args.num_gnn_layers,
+                                          config['backend'], config['diff_method'], args.precision,
+                                          not args.no_fusion, args.max_bond, config['chunk_size'],
+                                          args.trajectories if noisy else 1, args.checkpoint_hops)
+            if budget is not None and estimate['peak_bytes'] is not None and estimate['peak_bytes'] > budget:
+                timings[key] = None
+            else:
+                try:
+                    elapsed, peak = time_trial(make_model, config, trial_data, args.task, device, steps)
+                    timings[key] = elapsed if peak is None or budget is None or peak <= budget else None
+                except (RuntimeError, ValueError) as err:
+                    log(f"    skipped {config}: {err}")
+                    timings[key] = None
+            if timings[key] is not None:
+                log(f"    {timings[key]:.3f}s  {config}")
+        return timings[key]
+
+    for name, options in values.items():
+        results = []
+        for value in options:
+            config = dict(best)
+            if name == 'backend':
+                config['backend'], config['diff_method'] = value
+            else:
+                config[name] = value
+            elapsed = measure(config)
+            if elapsed is not None:
+                results.append((elapsed, config))
+        if results:
+            best = min(results, key=lambda r: r[0])[1]
+    if measure(best) is None:
+        raise ValueError("No configuration fits in the memory cap")
+    return best
+
+
+def autotune(args, make_model, w_shapes, train_data, device, budget, path, retune=False, log=print):
+    """Tuned settings for this run, from the cache at ``path`` unless missing or ``retune``.
+
+    The global RNG states are restored afterwards, so tuning does not change the
+    initialization or sampling of the actual run.
+    """
+    key = cache_key(args, device)
+    cache = load_cache(path)
+    if key in cache and not retune:
+        log(f"Autotune: using cached settings for {key}")
+        return cache[key]
+    log(f"Autotune: timing configurations for {key}")
+    torch_state, python_state, threads = torch.get_rng_state(), random.getstate(), torch.get_num_threads()
+    try:
+        config = tune(args, make_model, w_shapes, train_data, device, budget, log=log)
+    finally:
+        torch.set_rng_state(torch_state)
+        random.setstate(python_state)
+        torch.set_num_threads(threads)
+    cache[key] = config
+    save_cache(path, cache)
+    return config
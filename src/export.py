@@ -0,0 +1,85 @@
+import torch
+from torch import nn
+
+from qsim import StarCircuitLayer
+
+
+# Export of a trained QGNN classifier into a single self-describing artifact
+# (see runtime.py). Classical layers are stored as plain eval-mode tensors,
+# quantum layers as their weights plus the compiled (fused, complex128)
+# statevector program, so inference needs neither PennyLane nor PyG.
+
+FORMAT = 'qgnn-artifact'
+VERSION = 1
+
+
+def tensor(t):
+    return None if t is None else t.detach().cpu().clone()
+
+
+def norm_spec(norm):
+    # PyG norms wrap the torch module in ``.module``
+    norm = getattr(norm, 'module', norm)
+    if isinstance(norm, nn.Identity):
+        return None
+    if isinstance(norm, nn.BatchNorm1d):
+        return {'type': 'batch_norm', 'weight': tensor(norm.weight), 'bias': tensor(norm.bias),
+                'running_mean': tensor(norm.running_mean), 'running_var': tensor(norm.running_var), 'eps': norm.eps}
+    if isinstance(norm, nn.LayerNorm):
+        return {'type': 'layer_norm', 'weight': tensor(norm.weight), 'bias': tensor(norm.bias), 'eps': norm.eps}
+    raise ValueError(f"Cannot export normalization layer {type(norm).__name__}")
+
+
+def mlp_spec(mlp):
+    """Eval-mode layers of a torch_geometric MLP (dropout dropped)."""
+    act = mlp.act
+    if act is not None and not isinstance(act, nn.LeakyReLU):
+        raise ValueError(f"Cannot export activation {type(act).__name__}")
+    layers = []
+    for k, lin in enumerate(mlp.lins):
+        hidden = k < len(mlp.lins) - 1 or not mlp.plain_last
+        layers.append({'weight': tensor(lin.weight), 'bias': tensor(lin.bias),
+                       'norm': norm_spec(mlp.norms[k]) if hidden and k < len(mlp.norms) else None,
+                       'act': hidden and act is not None})
+    return {'layers': layers, 'act_first': bool(getattr(mlp, 'act_first', False)),
+            'negative_slope': act.negative_slope if act is not None else 0.0}
+
+
+@torch.no_grad()
+def quantum_spec(layer):
+    # Works for StarCircuitLayer and TorchLayer: both register the weights under the w_shapes names
+    weights = {name: tensor(param) for name, param in layer.named_parameters()}
+    star = StarCircuitLayer({name: tuple(w.shape) for name, w in weights.items()}, precision='double')
+    star.load_state_dict(weights)
+    ops = star.compile_ops(torch.device('cpu'))
+    return {'num_slots': star.num_slots, 'weights': weights,
+            'program': [{'wires': list(op.wires), 'matrix': tensor(op.matrix), 'slot': op.slot} for op in ops]}
+
+
+def export_model(model, path):
+    """Write a trained QGNNGraphClassifier / QGNNNodeClassifier to ``path``."""
+    from model import QGNNGraphClassifier, QGNNNodeClassifier
+    if isinstance(model, QGNNGraphClassifier):
+        task, head = 'graph', model.graph_head
+    elif isinstance(model, QGNNNodeClassifier):
+        task, head = 'node', model.final_layer
+    else:
+        raise ValueError(f"Cannot export {type(model).__name__}")
+    hops = []
+    for i in range(model.hop_neighbor):
+        hops.append({'quantum': quantum_spec(model.qconvs[f"lay{i+1}"]),
+                     'update': mlp_spec(model.upds[f"lay{i+1}"]),
+                     'norm': norm_spec(model.norms[f"lay{i+1}"])})
+    artifact = {
+        'format': FORMAT,
+        'version': VERSION,
+        'task': task,
+        'config': {'graphlet_size': model.graphlet_size, 'edge_input_dim': model.edge_input_dim,
+                   'node_input_dim': model.node_input_dim, 'star_planner': model.star_planner},
+        'input_node': mlp_spec(model.input_node),
+        'input_edge': mlp_spec(model.input_edge),
+        'hops': hops,
+        'head': mlp_spec(head),
+    }
+    torch.save(artifact, path)
+    return artifact
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+# Job batching between the QGNN quantum layers and a QPU-style service: the
+# star circuits of a hop are packed into jobs of at most ``job_size`` circuits,
+# all jobs are submitted at once and the results are collected in submission
+# order, so they map back to the centers they came from. Submission is
+# asynchronous only among the jobs of one call: they overlap with each other,
+# but the caller (the hop's forward) waits for all of them.
+
+# ``fn(*args, **kwargs)`` evaluates ``num_circuits`` star circuits
+Job = namedtuple('Job', ['fn', 'args', 'kwargs', 'num_circuits', 'grad_enabled'])
+
+
+class FakeRemoteBackend:
+    """In-process stand-in for a remote QPU service.
+
+    Every job waits ``latency`` seconds plus ``per_circuit`` seconds per circuit
+    before it runs on the local simulator. At most ``max_workers`` jobs are in
+    flight; the others queue up as they would on a shared device.
+    """
+
+    def __init__(self, latency=0.5, per_circuit=0.0, max_workers=4):
+        self.latency = latency
+        self.per_circuit = per_circuit
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'jobs': 0, 'circuits': 0, 'queue_time': 0.0, 'run_time': 0.0}
+
+    def close(self):
+        # Waits for the jobs in flight, then stops the workers
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, job):
+        return self.pool.submit(self._execute, job, time.perf_counter())
+
+    def _execute(self, job, submitted):
+        started = time.perf_counter()
+        time.sleep(self.latency + self.per_circuit * job.num_circuits)
+        # Grad mode is thread-local, use the one of the submitting thread
+        with torch.set_grad_enabled(job.grad_enabled):
+            result = job.fn(*job.args, **job.kwargs)
+        finished = time.perf_counter()
+        with self.lock:
+            self.stats['jobs'] += 1
+            self.stats['circuits'] += job.num_circuits
+            self.stats['queue_time'] += started - submitted
+            self.stats['run_time'] += finished - started
+        return result
+
+
+class JobBatcher:
+    """Packs star circuits into jobs of at most ``job_size`` circuits and runs them on ``backend``."""
+
+    def __init__(self, backend, job_size=256):
+        self.backend = backend
+        self.job_size = job_size
+        self.wall_time = 0.0
+
+    def reset_stats(self):
+        self.backend.reset_stats()
+        self.wall_time = 0.0
+
+    def job(self, fn, args, kwargs, num_circuits):
+        return Job(fn, args, kwargs, num_circuits, torch.is_grad_enabled())
+
+    def close(self):
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, jobs):
+        # Submit everything first, then wait: jobs overlap with each other up to the backend's
+        # concurrency, but the call itself blocks until all of them are done
+        start = time.perf_counter()
+        futures = [self.backend.submit(job) for job in jobs]
+        results = [future.result() for future in futures]
+        self.wall_time += time.perf_counter() - start
+        return results
+
+    def report(self):
+        stats = dict(self.backend.stats)
+        jobs = max(stats['jobs'], 1)
+        stats['mean_queue_time'] = stats['queue_time'] / jobs
+        stats['mean_job_time'] = stats['run_time'] / jobs
+        stats['wall_time'] = self.wall_time
+        stats['circuits_per_second'] = stats['circuits'] / self.wall_time if self.wall_time else 0.0
+        return stats
@@ -1,4 +1,5 @@
 import os
+import contextlib
 import torch
 import matplotlib.pyplot as plt
 import pennylane as qml
@@ -64,10 +65,245 @@ def get_args():
                         )
     parser.add_argument('--graphlet_size', type=int, default=10)
     
+    # Quantum simulation
+    parser.add_argument('--backend', type=str, default='pennylane',
+                        choices=['pennylane', 'statevector', 'rdm', 'mps', 'pauli', 'auto'],
+                        help='Simulator for the QGNN quantum layers (auto: cheapest one that fits in memory)')
+    parser.add_argument('--memory_budget', type=float, default=None,
+                        help='Memory in GiB the quantum layers may use (default: free memory of the device)')
+    parser.add_argument('--chunk_size', type=int, default=None, help='Max stars per simulator call (torch backends)')
+    parser.add_argument('--max_bond', type=int, default=16, help='Max MPS bond dimension (mps backend)')
+    parser.add_argument('--pauli_max_weight', type=int, default=None, help='Drop Pauli strings heavier than this (pauli backend)')
+    parser.add_argument('--pauli_min_coeff', type=float, default=0.0, help='Drop Pauli strings with smaller coefficients (pauli backend)')
+    parser.add_argument('--pauli_max_terms', type=int, default=2 ** 16,
+                        help='Stop with an error when a propagated observable exceeds this many terms (pauli backend)')
+    parser.add_argument('--diff_method', type=str, default='backprop', choices=['backprop', 'adjoint', 'parameter-shift'],
+                        help='Gradient method of the quantum layers (adjoint, parameter-shift: pennylane and statevector backends)')
+    parser.add_argument('--precision', type=str, default='double', choices=['single', 'double'],
+                        help='Simulation precision, complex64 or complex128 (torch backends)')
+    parser.add_argument('--validate_precision', action='store_true',
+                        help='Report the max deviation of every quantum layer from a complex128 run')
+    parser.add_argument('--shots', type=int, default=None,
+                        help='Finite-shot readout with this many shots per star on average (torch backends)')
+    parser.add_argument('--shot_policy', type=str, default='uniform',
+                        choices=['uniform', 'degree', 'variance', 'equal_variance'],
+                        help='How the shot budget is split over the stars (equal_variance: fewest shots at the '
+                             'summed variance of uniform)')
+    parser.add_argument('--depolarizing', type=float, default=0.0,
+                        help='Depolarizing probability after each entangling block (statevector backend)')
+    parser.add_argument('--damping', type=float, default=0.0,
+                        help='Amplitude-damping rate after each entangling block (statevector backend)')
+    parser.add_argument('--trajectories', type=int, default=16, help='Noise trajectories per star')
+    parser.add_argument('--remote_latency', type=float, default=None,
+                        help='Run star circuits as jobs on a fake remote backend with this latency in seconds (torch backends)')
+    parser.add_argument('--job_size', type=int, default=256, help='Max circuits per remote job')
+    parser.add_argument('--remote_workers', type=int, default=4, help='Remote jobs in flight at once')
+    parser.add_argument('--surrogate_order', type=int, default=None,
+                        help='Evaluate with a Fourier surrogate truncated to this order (torch backends, small graphlets)')
+    parser.add_argument('--autotune', action='store_true',
+                        help='Use tuned chunk size, batch size and threads, plus backend and diff method if left at '
+                             'their defaults or --backend auto (timed trials on first use; bucketing granularity '
+                             'is only searched as chunk size)')
+    parser.add_argument('--retune', action='store_true', help='Redo the autotune trials even if cached settings exist')
+    parser.add_argument('--export', type=str, default=None,
+                        help='Write the trained QGNN as a torch-only inference artifact (see runtime.py) to this path')
+    parser.add_argument('--star_planner', type=str, default='sample', choices=['sample', 'cover'],
+                        help='QGNN stars: random neighbors per destination (sample) or coverage-planned graphlets (cover)')
+    parser.add_argument('--checkpoint_hops', action='store_true',
+                        help='Recompute each QGNN hop in backward instead of storing its quantum states')
+    parser.add_argument('--memory_report', action='store_true',
+                        help='Report training time and autograd memory per epoch (implied by --checkpoint_hops)')
+    parser.add_argument('--profile', type=int, default=0,
+                        help='Print a torch.profiler table for each of the first N training epochs')
+    parser.add_argument('--no_fusion', action='store_true', help='Simulate gate by gate instead of fused unitaries (torch backends)')
     
     return parser.parse_args()
 
 
+def get_job_batcher(args):
+    # One fake remote service shared by all quantum layers, created on first use
+    if args.remote_latency is None:
+        return None
+    if getattr(args, 'job_batcher', None) is None:
+        from jobs import FakeRemoteBackend, JobBatcher
+        backend = FakeRemoteBackend(latency=args.remote_latency, max_workers=args.remote_workers)
+        args.job_batcher = JobBatcher(backend, job_size=args.job_size)
+    return args.job_batcher
+
+
+def get_sim_options(args):
+    # Keyword arguments for StarCircuitLayer (only diff_method applies to the PennyLane backend)
+    if args.backend == 'pennylane':
+        return {'diff_method': args.diff_method}
+    options = {'chunk_size': args.chunk_size, 'fusion': not args.no_fusion, 'diff_method': args.diff_method,
+               'precision': args.precision, 'validate_precision': args.validate_precision,
+               'shots': args.shots, 'shot_policy': args.shot_policy, 'seed': args.seed,
+               'depolarizing': args.depolarizing, 'damping': args.damping, 'trajectories': args.trajectories,
+               'job_batcher': get_job_batcher(args), 'surrogate_order': args.surrogate_order}
+    if args.backend == 'mps':
+        options['max_bond'] = args.max_bond
+    elif args.backend == 'pauli':
+        options['pauli_max_weight'] = args.pauli_max_weight
+        options['pauli_min_coeff'] = args.pauli_min_coeff
+        options['pauli_max_terms'] = args.pauli_max_terms
+    return options
+
+
+def memory_budget(args, device):
+    # Bytes the quantum layers may use; free memory is only queried when --backend auto or
+    # --autotune needs it, None = unknown
+    from resources import available_memory
+    if args.memory_budget:
+        return args.memory_budget * 2 ** 30
+    if args.backend == 'auto' or args.autotune or args.retune:
+        return available_memory(device)
+    return None
+
+
+def plan_backend(args, w_shapes, train_graphs, eval_graphs, device):
+    # Print the resource estimate of the quantum layers and resolve --backend auto
+    from resources import AUTO_CANDIDATES, estimate_resources, format_bytes, format_estimate, select_backend
+    budget = memory_budget(args, device)
+    noisy = args.depolarizing > 0 or args.damping > 0
+    common = dict(batch_size=args.batch_size, hops=args.num_gnn_layers, precision=args.precision,
+                  fusion=not args.no_fusion, max_bond=args.max_bond, chunk_size=args.chunk_size,
+                  trajectories=args.trajectories if noisy else 1, checkpoint_hops=args.checkpoint_hops)
+    if args.backend != 'auto':
+        estimate = estimate_resources(w_shapes, train_graphs, eval_graphs, backend=args.backend,
+                                      diff_method=args.diff_method, **common)
+        print(f"Resource estimate: {format_estimate(estimate)}")
+        if budget is not None and estimate['peak_bytes'] is not None and estimate['peak_bytes'] > budget:
+            print(f"Warning: estimated peak memory exceeds the budget of {format_bytes(budget)}")
+        return
+    # Noisy trajectories only run on the statevector engine with backprop
+    candidates = [('statevector', 'backprop')] if noisy else AUTO_CANDIDATES
+    estimates = [estimate_resources(w_shapes, train_graphs, eval_graphs, backend=backend, diff_method=diff_method,
+                                    **common) for backend, diff_method in candidates]
+    for estimate in estimates:
+        print(f"Resource estimate: {format_estimate(estimate)}")
+    try:
+        choice = select_backend(estimates, budget)
+    except ValueError as err:
+        raise SystemExit(str(err))
+    args.backend, args.diff_method = choice['backend'], choice['diff_method']
+    limit = format_bytes(budget) if budget is not None else 'an unknown memory budget (pass --memory_budget)'
+    print(f"Selected backend: {args.backend} ({args.diff_method}) within {limit}")
+
+
+def build_qgnn(args, q_dev, w_shapes, node_input_dim, edge_input_dim, num_classes):
+    qgnn = QGNNGraphClassifier if args.task == 'graph' else QGNNNodeClassifier
+    return qgnn(
+        q_dev=q_dev,
+        w_shapes=w_shapes,
+        hidden_dim=args.hidden_channels,
+        node_input_dim=node_input_dim,
+        edge_input_dim=edge_input_dim,
+        graphlet_size=args.node_qubit,
+        hop_neighbor=args.num_gnn_layers,
+        num_classes=num_classes,
+        one_hot=0,
+        backend=args.backend,
+        sim_options=get_sim_options(args),
+        checkpoint_hops=args.checkpoint_hops,
+        sampling_seed=args.seed,
+        star_planner=args.star_planner
+    )
+
+
+@contextlib.contextmanager
+def profiled(enabled, row_limit=25):
+    # Profiler table of the enclosed code; qgnn.trace / qgnn.bind rows are circuit tracing and parameter binding
+    if not enabled:
+        yield
+        return
+    from torch.profiler import profile, ProfilerActivity
+    with profile(activities=[ProfilerActivity.CPU]) as prof:
+        yield
+    print(prof.key_averages().table(sort_by='cpu_time_total', row_limit=row_limit))
+
+
+@contextlib.contextmanager
+def autograd_memory(report, device, enabled=True):
+    # Time of the enclosed training code and bytes autograd saved for backward; checkpointed
+    # hops save only their inputs, the recomputation shows up as extra time
+    if not enabled:
+        yield report
+        return
+    report.update(saved_bytes=0, peak_bytes=None)
+    def pack(tensor):
+        report['saved_bytes'] += tensor.numel() * tensor.element_size()
+        return tensor
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        yield report
+    report['seconds'] = time.perf_counter() - start
+    if device.type == 'cuda':
+        report['peak_bytes'] = torch.cuda.max_memory_allocated(device)
+
+
+def print_memory_report(report, steps):
+    from resources import format_bytes
+    line = (f"    Training {report['seconds']:.2f}s, autograd saved {format_bytes(report['saved_bytes'] / steps)} "
+            f"per step")
+    if report['peak_bytes'] is not None:
+        line += f", peak {format_bytes(report['peak_bytes'])}"
+    print(line)
+
+
+def gate_counts(model):
+    # (gates, fused ops) per star circuit of every quantum layer
+    counts = {}
+    for name, layer in getattr(model, 'qconvs', {}).items():
+        if hasattr(layer, 'compile_ops'):
+            with torch.no_grad():
+                layer.compile_ops(next(layer.parameters()).device)
+            counts[name] = layer.gate_counts
+    return counts
+
+
+def circuits_per_step(model, key='circuits'):
+    # Circuits executed by the quantum layers for the last optimizer step (parameter-shift)
+    return sum(layer.circuits_per_step(key) for layer in getattr(model, 'qconvs', {}).values()
+               if hasattr(layer, 'circuits_per_step'))
+
+
+def layer_total(model, name):
+    # Sum of ``name`` (e.g. shots) over the quantum layers in the last forward
+    return sum(getattr(layer, name, 0) for layer in getattr(model, 'qconvs', {}).values())
+
+
+def layer_error(model, name='truncation_error'):
+    # Largest ``name`` error (MPS truncation, precision deviation) over the quantum layers in the last forward
+    errors = [getattr(layer, name, 0.0) for layer in getattr(model, 'qconvs', {}).values()]
+    return max(errors, default=0.0)
+
+
+def print_layer_diagnostics(args, model, memory, steps):
+    # Per-epoch report of the quantum layers; ``steps`` optimizer steps per epoch for the memory report
+    if args.backend == 'mps':
+        print(f"    MPS truncation error (max bond {args.max_bond}): {layer_error(model):.3e}")
+    if args.backend == 'pauli':
+        print(f"    Pauli terms per observable (max weight {args.pauli_max_weight}): {layer_error(model, 'pauli_terms')}")
+    if args.validate_precision:
+        print(f"    Max deviation from complex128 ({args.precision}): {layer_error(model, 'precision_error'):.3e}")
+    if args.depolarizing or args.damping:
+        print(f"    Noise standard error ({args.trajectories} trajectories): "
+              f"{layer_error(model, 'noise_stderr'):.3e}")
+    if args.surrogate_order is not None:
+        print(f"    Surrogate error bound (order {args.surrogate_order}): "
+              f"{layer_error(model, 'surrogate_bound'):.3e}")
+    if args.shots:
+        print(f"    Shots in the last forward ({args.shot_policy}): {layer_total(model, 'total_shots')}, "
+              f"{layer_total(model, 'shots_saved')} fewer than uniform")
+    if args.diff_method == 'parameter-shift' and args.backend != 'pennylane':
+        print(f"    Circuits per optimizer step: {circuits_per_step(model)} "
+              f"({circuits_per_step(model, 'shared_circuits')} re-shift weights shared across slots)")
+    if args.memory_report or args.checkpoint_hops:
+        print_memory_report(memory, steps)
+
+
 def main(args):
     args.node_qubit = args.graphlet_size
     edge_qubit = args.node_qubit - 1
@@ -111,20 +347,43 @@ def main(args):
     node_input_dim = dataset[0].x.shape[1] if dataset[0].x is not None else 0
     edge_input_dim = dataset[0].edge_attr.shape[1] if dataset[0].edge_attr is not None else 0
     num_classes = dataset.num_classes
+
+    if args.model == 'qgnn' and (args.autotune or args.retune):
+        from autotune import autotune
+        # Trials share the run's remote backend instead of each starting (and leaking) their own
+        get_job_batcher(args)
+        make_model = lambda config: build_qgnn(argparse.Namespace(**{**vars(args), **config}), q_dev, w_shapes_dict,
+                                               node_input_dim, edge_input_dim, num_classes)
+        train_data = train_loader.dataset if args.task == 'graph' else train_loader
+        config = autotune(args, make_model, w_shapes_dict, train_data, device, memory_budget(args, device),
+                          os.path.join(result_dir, 'autotune.json'), retune=args.retune)
+        print(f"Autotune: {config}")
+        if get_job_batcher(args) is not None:
+            get_job_batcher(args).reset_stats()
+        for name, value in config.items():
+            if name in vars(args) and getattr(args, name) != value:
+                print(f"Autotune: --{name} {getattr(args, name)} -> {value}")
+            setattr(args, name, value)
+        torch.set_num_threads(args.threads)
+        if args.task == 'graph':
+            dataset, train_loader, test_loader, task_type = load_dataset(
+                name=args.dataset,
+                path='../data',
+                train_size=args.train_size,
+                test_size=args.test_size,
+                batch_size=args.batch_size
+            )
+
+    if args.model == 'qgnn':
+        if args.task == 'graph':
+            train_graphs = list(train_loader.dataset)
+            plan_backend(args, w_shapes_dict, train_graphs, train_graphs + list(test_loader.dataset), device)
+        else:
+            plan_backend(args, w_shapes_dict, [train_loader], [train_loader], device)
     # Model init
     if args.task == 'graph':
         if args.model == 'qgnn':
-            model = QGNNGraphClassifier(
-                q_dev=q_dev,
-                w_shapes=w_shapes_dict,
-                hidden_dim=args.hidden_channels,
-                node_input_dim=node_input_dim,
-                edge_input_dim=edge_input_dim,
-                graphlet_size=args.node_qubit,
-                hop_neighbor=args.num_gnn_layers,
-                num_classes=num_classes,
-                one_hot=0
-            )
+            model = build_qgnn(args, q_dev, w_shapes_dict, node_input_dim, edge_input_dim, num_classes)
         elif args.model == 'handcraft':
             model = HandcraftGNN(
                 q_dev=q_dev,
@@ -183,17 +442,7 @@ def main(args):
     elif args.task == 'node':
         data = dataset[0].to(device)
         if args.model == 'qgnn':
-            model = QGNNNodeClassifier(
-                q_dev=q_dev,
-                w_shapes=w_shapes_dict,
-                hidden_dim=args.hidden_channels,
-                node_input_dim=node_input_dim,
-                edge_input_dim=edge_input_dim,
-                graphlet_size=args.node_qubit,
-                hop_neighbor=args.num_gnn_layers,
-                num_classes=num_classes,
-                one_hot=0
-            )
+            model = build_qgnn(args, q_dev, w_shapes_dict, node_input_dim, edge_input_dim, num_classes)
         elif args.model == 'handcraft':
             model = HandcraftGNN_NodeClassification(
                 q_dev=q_dev,
@@ -307,11 +556,16 @@ def main(args):
         
     print(f"Training model {args.model} on {args.dataset} with {args.graphlet_size} graphlet size with {args.epochs} epochs, "
           f"learning rate {args.lr}, step size {args.step_size}, and gamma {args.gamma}.")
+    for name, (n_gates, n_ops) in gate_counts(model).items():
+        print(f"Quantum layer {name} ({args.backend}): {n_gates} gates -> {n_ops} ops per star")
+    memory = {}
+    memory_report = args.memory_report or args.checkpoint_hops
     if args.continue_train or args.pre_train is None:
     
         if args.task == 'graph':
             for epoch in range(args.epochs):
-                train_graph(model, optimizer, train_loader, criterion, device)
+                with profiled(epoch < args.profile), autograd_memory(memory, device, memory_report):
+                    train_graph(model, optimizer, train_loader, criterion, device)
                 train_loss, train_acc, f1_train = test_graph(model, train_loader, criterion, device, num_classes)
                 test_loss, test_acc, f1_test = test_graph(model, test_loader, criterion, device, num_classes)
                 scheduler.step()
@@ -352,6 +606,7 @@ def main(args):
                 if epoch % step_plot == 0:
                     print(f"Epoch {epoch:02d} | Train Loss: {train_loss:.4f}, Acc: {train_acc:.4f} | "
                         f"Test Loss: {test_loss:.4f}, Acc: {test_acc:.4f}")
+                    print_layer_diagnostics(args, model, memory, len(train_loader))
         else:  # node task
             scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
                 optimizer, 
@@ -362,7 +617,8 @@ def main(args):
             )
             from utils import train_node, test_node
             for epoch in range(1, args.epochs + 1):
-                train_loss = train_node(model, optimizer, data, criterion, device)
+                with profiled(epoch <= args.profile), autograd_memory(memory, device, memory_report):
+                    train_loss = train_node(model, optimizer, data, criterion, device)
                 test_metrics = test_node(model, data, criterion, device, num_classes)
                 train_losses.append(test_metrics['train']['loss'])
                 test_losses.append(test_metrics['test']['loss'])
@@ -378,10 +634,21 @@ def main(args):
                     print(f"Epoch {epoch+1:02d}/{args.epochs+1:02d} | Train Loss: {train_loss:.4f} |" +
                         f"Train Acc: {test_metrics['train']['acc']:.4f} | "
                         f"Val Acc: {test_metrics['val']['acc']:.4f} | Test Acc: {test_metrics['test']['acc']:.4f}")
+                    print_layer_diagnostics(args, model, memory, 1)
     if args.save_model:
             print(f"Model checkpoint saved to {model_save}")
+    if args.export:
+        from export import export_model
+        export_model(model, args.export)
+        print(f"Inference artifact written to {args.export}")
     end = time.time()
     print(f"Total execution time: {end - start:.6f} seconds")
+    if get_job_batcher(args) is not None:
+        report = get_job_batcher(args).report()
+        print(f"Remote jobs: {report['jobs']} jobs, {report['circuits']} circuits, "
+              f"mean queue {report['mean_queue_time']:.3f}s, mean job {report['mean_job_time']:.3f}s, "
+              f"{report['circuits_per_second']:.1f} circuits/s")
+        get_job_batcher(args).close()
     if args.plot:
         if args.pre_train is None:
             pre_train_epoch = 0
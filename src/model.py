@@ -5,7 +5,11 @@ from pennylane import numpy as np
 import torch.nn.functional as F
 from torch_geometric.nn import MLP, global_add_pool, global_mean_pool, global_max_pool   
 
-from utils import star_subgraph
+from torch.profiler import record_function
+from torch.utils.checkpoint import checkpoint
+
+from utils import adjacency_csr, build_csr, cover_stars, seeded_generator, star_order, sample_stars
+from qsim import StarCircuitLayer
 
 
 # def message_passing_pqc_aux(strong, twodesign, inits, wires):
@@ -97,17 +101,21 @@ def message_passing_pqc(strong, twodesign, inits, wires):
 
 def qgcn_enhance_layer(inputs, spreadlayer, strong, twodesign, inits, update):
     edge_feat_dim = feat_dim = node_feat_dim = 2
-    inputs = inputs.reshape(-1,feat_dim)
+    # Leading dims (if any) are a parameter-broadcasting batch of stars with the same size
+    inputs = inputs.reshape(*inputs.shape[:-1], -1, feat_dim)
     
     # The number of avaible nodes and edges
-    total_shape = inputs.shape[0]
+    total_shape = inputs.shape[-2]
     num_nodes = (total_shape+1)//2
     num_edges = num_nodes - 1
     
-    adjacency_matrix, vertex_features = inputs[:num_edges,:], inputs[num_edges:,:]
+    adjacency_matrix, vertex_features = inputs[..., :num_edges, :], inputs[..., num_edges:, :]
 
     # The number of qubits assiged to each node and edge
-    num_qbit = spreadlayer.shape[1]
+    # num_qbit = spreadlayer.shape[1]
+    # Wires are laid out for the actual star size (unused wires of the full layout
+    # stay in |0>), so narrow stars run on narrow devices with identical results
+    num_qbit = 2 * num_edges + 1
     num_nodes_qbit = (num_qbit+1)//2
     num_edges_qbit = num_nodes_qbit - 1
     
@@ -115,14 +123,14 @@ def qgcn_enhance_layer(inputs, spreadlayer, strong, twodesign, inits, update):
     
     
     for i in range(num_edges):
-        qml.RX(adjacency_matrix[i][0], wires=i)
-        qml.RZ(adjacency_matrix[i][1], wires=i)
-        # qml.RX(adjacency_matrix[i][2], wires=i)
+        qml.RX(adjacency_matrix[..., i, 0], wires=i)
+        qml.RZ(adjacency_matrix[..., i, 1], wires=i)
+        # qml.RX(adjacency_matrix[..., i, 2], wires=i)
     
     for i in range(num_nodes):
-        qml.RX(vertex_features[i][0], wires=center_wire+i)
-        qml.RZ(vertex_features[i][1], wires=center_wire+i)
-        # qml.RX(vertex_features[i][2], wires=center_wire+i)
+        qml.RX(vertex_features[..., i, 0], wires=center_wire+i)
+        qml.RZ(vertex_features[..., i, 1], wires=center_wire+i)
+        # qml.RX(vertex_features[..., i, 2], wires=center_wire+i)
     
     
     for i in range(num_edges):
@@ -173,14 +181,167 @@ def input_process(tensor):
     return torch.tanh(tensor) * np.pi
 
 
+# Tape replay goes through qml.QNode.get_gradient_fn and qml.execute(gradient_fn=...), which
+# later PennyLane releases removed; other versions use the stock TorchLayer path
+TAPE_REPLAY = qml.__version__.startswith('0.38.') and hasattr(qml.QNode, 'get_gradient_fn')
+
+
+class PooledTorchLayer(qml.qnn.TorchLayer):
+    """TorchLayer that runs every star on a device with just the wires it needs.
+
+    Devices are created on demand and kept per wire count; all of them share the
+    weights of this layer. The circuit of each wire count is traced into a tape
+    once and later calls only bind new parameters to it (PennyLane 0.38 only,
+    see ``TAPE_REPLAY``).
+    """
+
+    def __init__(self, qnode, weight_shapes, init_method=None, device_name="default.qubit"):
+        super().__init__(qnode, weight_shapes, init_method)
+        self.device_name = device_name
+        self.pool = {}
+        # num_wires -> (tape, parameter sources, gradient_fn, gradient_kwargs, device) or None (not traceable)
+        self.tapes = {}
+
+    def pooled_qnode(self, num_wires):
+        if num_wires not in self.pool:
+            self.pool[num_wires] = qml.QNode(self.qnode.func, qml.device(self.device_name, wires=num_wires),
+                                             interface="torch", diff_method=self.qnode.diff_method)
+        return self.pool[num_wires]
+
+    def trace(self, num_inputs):
+        # Trace the circuit on placeholder tensors holding their own flat index, so every
+        # tape parameter is known as a gather from the inputs or the flat weights
+        if not TAPE_REPLAY:
+            return None
+        names = list(self.qnode_weights)
+        ids = {self.input_arg: torch.arange(num_inputs, dtype=torch.float64)}
+        offset = num_inputs
+        for name in names:
+            shape = self.qnode_weights[name].shape
+            ids[name] = torch.arange(offset, offset + shape.numel(), dtype=torch.float64).reshape(shape)
+            offset += shape.numel()
+        tape = qml.tape.make_qscript(self.qnode.func)(**ids)
+        sources = []
+        for param in tape.get_parameters(trainable_only=False):
+            index = torch.as_tensor(param)
+            if not torch.equal(index, index.round()):
+                return None
+            index = index.long()
+            if (index < num_inputs).all():
+                sources.append((True, index))
+            elif (index >= num_inputs).all():
+                sources.append((False, index - num_inputs))
+            else:
+                return None
+        gradient_fn, gradient_kwargs, device = qml.QNode.get_gradient_fn(
+            self.qnode.device, "torch", self.qnode.diff_method, tape=tape)
+        return tape, names, sources, gradient_fn, gradient_kwargs, device
+
+    def _evaluate_qnode(self, x):
+        num_wires = x.shape[-1] // 2 + 2
+        if num_wires not in self.tapes:
+            with record_function('qgnn.trace'):
+                self.tapes[num_wires] = self.trace(x.shape[-1])
+        if self.tapes[num_wires] is None:
+            return super()._evaluate_qnode(x)
+        tape, names, sources, gradient_fn, gradient_kwargs, device = self.tapes[num_wires]
+        with record_function('qgnn.bind'):
+            weights = torch.cat([self.qnode_weights[name].to(x).reshape(-1) for name in names])
+            params = [x[..., index] if from_inputs else weights[index] for from_inputs, index in sources]
+            tape = tape.bind_new_parameters(params, list(range(len(params))))
+            tape.trainable_params = qml.math.get_trainable_indices(params)
+        res = qml.execute([tape], device, gradient_fn=gradient_fn, gradient_kwargs=gradient_kwargs,
+                          interface="torch")[0]
+        if x.dim() > 1:
+            res = [torch.reshape(r, (x.shape[0], -1)) for r in res]
+        return torch.hstack(res).type(x.dtype)
+
+    def forward(self, inputs):
+        # inputs: (..., 2 * (2 * num_edges + 1)) -> 2 * num_edges + 3 wires
+        num_wires = inputs.shape[-1] // 2 + 2
+        full_qnode, self.qnode = self.qnode, self.pooled_qnode(num_wires)
+        try:
+            return super().forward(inputs)
+        finally:
+            self.qnode = full_qnode
+
+
+def make_qconv(q_dev, w_shapes, backend='pennylane', sim_options=None):
+    # One quantum layer per hop: PennyLane TorchLayer or the batched torch simulator
+    sim_options = dict(sim_options or {})
+    if backend == 'pennylane':
+        diff_method = sim_options.get('diff_method', 'backprop')
+        qnode = qml.QNode(qgcn_enhance_layer, q_dev,  interface="torch", diff_method=diff_method)
+        device_name = getattr(q_dev, 'short_name', q_dev.name)
+        return PooledTorchLayer(qnode, w_shapes, uniform_pi_init, device_name)
+    return StarCircuitLayer(w_shapes, uniform_pi_init, backend=backend, **sim_options)
+
+
+def quantum_messages(q_layer, node_features, edge_features, centers, nbr_idx, edge_idx, mask):
+    # (num_stars, pqc_out) expectations for a padded batch of stars
+    if isinstance(q_layer, StarCircuitLayer):
+        return q_layer(node_features, edge_features, centers, nbr_idx, edge_idx, mask)
+    # TorchLayer: one broadcast QNode call per neighbor count (slots are filled left to right)
+    counts = mask.sum(1)
+    msgs = None
+    for n in counts.unique().tolist():
+        idx = (counts == n).nonzero(as_tuple=True)[0]
+        n_feat = torch.cat([node_features[centers[idx]].unsqueeze(1), node_features[nbr_idx[idx, :n]]], dim=1)
+        e_feat = edge_features[edge_idx[idx, :n]]
+        inputs = torch.cat([e_feat, n_feat], dim=1)
+        out = q_layer(inputs.flatten(1))
+        if msgs is None:
+            msgs = torch.zeros(centers.shape[0], out.shape[-1], dtype=out.dtype, device=out.device)
+        msgs = msgs.index_add(0, idx, out)
+    return msgs
+
+
+def checkpoint_hop(hop, q_layer, *args):
+    """``hop(*args)`` under activation checkpointing: only the hop inputs are kept for backward.
+
+    Neighbor sampling happens before, so the recomputation sees the same stars.
+    The layer's shot / noise generator is rewound for the recomputation and
+    restored after it.
+    """
+    generator = None
+    if isinstance(q_layer, StarCircuitLayer):
+        generator = q_layer.generator(args[1].device)
+    start = generator.get_state() if generator is not None else None
+    runs = []
+
+    def run(*inputs):
+        replay = generator is not None and runs
+        if replay:
+            current = generator.get_state()
+            generator.set_state(start)
+        out = hop(*inputs)
+        if replay:
+            generator.set_state(current)
+        runs.append(True)
+        return out
+
+    return checkpoint(run, *args, use_reentrant=False)
+
+
 class QGNNGraphClassifier(nn.Module):
     def __init__(self, q_dev, w_shapes, hidden_dim, node_input_dim=1, edge_input_dim=1,
-                 graphlet_size=4, hop_neighbor=1, num_classes=2, one_hot=0):
+                 graphlet_size=4, hop_neighbor=1, num_classes=2, one_hot=0,
+                 backend='pennylane', sim_options=None, checkpoint_hops=False, sampling_seed=None,
+                 star_planner='sample'):
         super().__init__()
         self.hidden_dim = hidden_dim
         self.graphlet_size = graphlet_size
         self.one_hot = one_hot
         self.hop_neighbor = hop_neighbor
+        # Recompute each hop in backward instead of keeping its quantum states
+        self.checkpoint_hops = checkpoint_hops
+        # Seeds center order and neighbor sampling (None: global RNG)
+        self.sampling_seed = sampling_seed
+        self._sampler = None
+        # 'sample': random neighbors per destination; 'cover': plan_graphlets coverage stars
+        if star_planner not in ('sample', 'cover'):
+            raise ValueError(f"Unknown star planner '{star_planner}'")
+        self.star_planner = star_planner
         self.pqc_dim = 2 # number of feat per pqc for each node
         self.chunk = 1
         self.final_dim = self.pqc_dim * self.chunk # 2
@@ -216,8 +377,7 @@ class QGNNGraphClassifier(nn.Module):
             )
         
         for i in range(self.hop_neighbor):
-            qnode = qml.QNode(qgcn_enhance_layer, q_dev,  interface="torch")
-            self.qconvs[f"lay{i+1}"] = qml.qnn.TorchLayer(qnode, w_shapes, uniform_pi_init)
+            self.qconvs[f"lay{i+1}"] = make_qconv(q_dev, w_shapes, backend, sim_options)
             
             self.upds[f"lay{i+1}"] = MLP(
                     [self.pqc_dim + self.pqc_out, self.hidden_dim, self.pqc_dim],
@@ -234,17 +394,23 @@ class QGNNGraphClassifier(nn.Module):
                 dropout=0.1
         ) 
         
-    def sampling_neighbors(self, neighbor_ids, edge_ids):
-        # if neighbor_ids.numel() == 0:
-        #     return neighbor_ids, edge_ids
+    def hop(self, i, node_features, edge_features, centers, nbr_idx, edge_idx, star_mask):
+        # One message-passing hop on pre-sampled stars
+        q_layer = self.qconvs[f"lay{i+1}"]
+        upd_layer = self.upds[f"lay{i+1}"]
+        norm_layer = self.norms[f"lay{i+1}"]
+        aggr = quantum_messages(q_layer, node_features, edge_features, centers, nbr_idx, edge_idx, star_mask)
+        # aggr = input_process(aggr)
+        updates = upd_layer(torch.cat([node_features[centers], aggr], dim=1))
+        updates_node = torch.zeros_like(node_features)
+        updates_node = updates_node.index_add(0, centers, updates)
+
+        # node_features = norm_layer(updates_node + node_features)
+        # node_features = updates_node + node_features
+        # node_features = F.relu(norm_layer(updates_node + node_features)) # Add ReLU
+        # node_features = norm_layer(updates_node + node_features) # No ReLU
+        return norm_layer(updates_node) + node_features # No ReLU
 
-        if neighbor_ids.numel() > self.graphlet_size - 1:
-            perm = torch.randperm(neighbor_ids.numel())[:self.graphlet_size - 1]
-            neighbor_ids = neighbor_ids[perm]
-            edge_ids = edge_ids[perm]
-            
-        return neighbor_ids, edge_ids
-        
     def forward(self, node_feat, edge_attr, edge_index, batch):
         edge_index = edge_index.t()
         num_nodes = node_feat.size(0)
@@ -264,65 +430,30 @@ class QGNNGraphClassifier(nn.Module):
         # # node_features = node_features + 0.01 * torch.randn_like(node_features)
         edge_features = input_process(edge_features)
         
-        
-        idx_dict = {
-            (int(u), int(v)): i
-            for i, (u, v) in enumerate(edge_index.tolist())
-        }
-        
-
-        adj_mtx = torch.zeros((num_nodes, num_nodes), dtype=torch.int)
-        adj_mtx[edge_index[:, 0], edge_index[:, 1]] = 1
-        adj_mtx[edge_index[:, 1], edge_index[:, 0]] = 1
-        
-        
+        # Neighbor index and center order are shared by all hops
+        if self.star_planner == 'cover':
+            self._sampler = seeded_generator(self._sampler, self.sampling_seed, 'cpu')
+            adjacency = adjacency_csr(edge_index, num_nodes)
+        else:
+            self._sampler = seeded_generator(self._sampler, self.sampling_seed, edge_index.device)
+            csr = build_csr(edge_index)
+            order = star_order(csr, self._sampler)
         for i in range(self.hop_neighbor):
-            subgraphs = star_subgraph(adj_mtx.cpu().numpy(), subgraph_size=self.graphlet_size)
-            node_upd = torch.zeros((num_nodes, self.final_dim), device=node_features.device)
             q_layer = self.qconvs[f"lay{i+1}"]
-            upd_layer = self.upds[f"lay{i+1}"]
-            norm_layer = self.norms[f"lay{i+1}"]
 
             # updates_node = node_features.clone() 
             
-            centers = []
-            updates = []
-            
             ## FIXME: #####################################
-            dst_indices = torch.unique(edge_index[:,1])
-            perm = torch.randperm(dst_indices.shape[0])
-            dst_indices = dst_indices[perm].tolist()
-            for center in dst_indices:
-                neighbor_mask = (edge_index[:,1] == center)
-                neighbor_ids = edge_index[:,0][neighbor_mask]
-                edge_ids = torch.nonzero(neighbor_mask, as_tuple=False).squeeze()
-                neighbor_ids, edge_ids  = self.sampling_neighbors(neighbor_ids, edge_ids)
-                
-                
-                center_ft = node_features[center]
-                neighbors = node_features[neighbor_ids]
-                n_feat = torch.cat([center_ft.unsqueeze(0), neighbors], dim=0)
-                e_feat = edge_features[edge_ids.view(-1)]
-                inputs = torch.cat([e_feat, n_feat], dim=0)     
-
-                all_msg = q_layer(inputs.flatten())
-                aggr = all_msg
-                # aggr = input_process(all_msg)
-                update_vec = upd_layer(torch.cat([node_features[center], aggr], dim=0))
-            
-                centers.append(center)
-                updates.append(update_vec)
-            
-            centers = torch.tensor(centers, device=node_features.device)
-            updates = torch.stack(updates, dim=0) 
-            updates_node = torch.zeros_like(node_features)
-            updates_node = updates_node.index_add(0, centers, updates)
-            
-            # node_features = norm_layer(updates_node + node_features)    
-            # node_features = updates_node + node_features
-            # node_features = F.relu(norm_layer(updates_node + node_features)) # Add ReLU
-            # node_features = norm_layer(updates_node + node_features) # No ReLU
-            node_features = norm_layer(updates_node) + node_features # No ReLU
+            if self.star_planner == 'cover':
+                centers, nbr_idx, edge_idx, star_mask = cover_stars(adjacency, self.graphlet_size - 1, self._sampler,
+                                                                    edge_index.device)
+            else:
+                centers, nbr_idx, edge_idx, star_mask = sample_stars(csr, self.graphlet_size - 1, order, self._sampler)
+            stars = (node_features, edge_features, centers, nbr_idx, edge_idx, star_mask)
+            if self.checkpoint_hops and torch.is_grad_enabled():
+                node_features = checkpoint_hop(self.hop, q_layer, i, *stars)
+            else:
+                node_features = self.hop(i, *stars)
         # graph_embedding = global_mean_pool(node_features, batch)
         graph_embedding = global_add_pool(node_features, batch)
         # graph_embedding = F.relu(graph_embedding)
@@ -394,17 +525,6 @@ class QGNN_HetNodeClassifier(nn.Module):
                 dropout=0.1
         ) 
         
-    def sampling_neighbors(self, neighbor_ids, edge_ids):
-        # if neighbor_ids.numel() == 0:
-        #     return neighbor_ids, edge_ids
-
-        if neighbor_ids.numel() > self.graphlet_size - 1:
-            perm = torch.randperm(neighbor_ids.numel())[:self.graphlet_size - 1]
-            neighbor_ids = neighbor_ids[perm]
-            edge_ids = edge_ids[perm]
-            
-        return neighbor_ids, edge_ids
-        
     def forward(self, x_dict, edge_attr_dict, edge_index_dict, batch_dict):        
         for node_type, node_feat in x_dict.items():
             x_dict[node_type] = self.input_node[node_type](node_feat.float())
@@ -415,8 +535,15 @@ class QGNN_HetNodeClassifier(nn.Module):
         
         
         
+        # Per edge type: destination CSR and center order, shared by all hops
+        csrs = {}
+        for edge_type, edge_index in edge_index_dict.items():
+            csr = build_csr(edge_index.t())
+            csrs[edge_type] = (csr, star_order(csr))
+        
         for i in range(self.hop_neighbor):
             for edge_type, edge_index in edge_index_dict.items():
+                src_type, _, dst_type = edge_type
                 q_layer = self.qconvs[f"lay{i+1}_{dst_type}"]
                 upd_layer = self.upds[f"lay{i+1}_{dst_type}"]
                 norm_layer = self.norms[f"lay{i+1}_{dst_type}"]
@@ -425,33 +552,14 @@ class QGNN_HetNodeClassifier(nn.Module):
                 src_feat = x_dict[src_type]
                 dst_feat = x_dict[dst_type]
                 
-                centers = []
-                updates = []
-            
-                ## FIXME: #####################################
-                dst_indices = torch.unique(edge_index[:,1])
-                perm = torch.randperm(dst_indices.shape[0])
-                dst_indices = dst_indices[perm].tolist()
-                for dst_idx in dst_indices:
-                    neighbor_mask = (edge_index[1] == dst_idx)
-                    neighbor_ids = edge_index[0][neighbor_mask]
-                    edge_ids = torch.nonzero(neighbor_mask, as_tuple=False).squeeze()
-                    neighbor_ids, edge_ids  = self.sampling_neighbors(neighbor_ids, edge_ids)
-                    
-                    center = dst_feat[dst_idx]
-                    neighbors = src_feat[neighbor_ids]
-                    n_feat = torch.cat([center.unsqueeze(0), neighbors], dim=0)
-                    e_feat = edge_attr[edge_ids.view(-1)]
-                    
-                    inputs = torch.cat([e_feat, n_feat], dim=0)
-                    all_msg = q_layer(inputs.flatten())
-                    aggr = all_msg
-                    update_dst = upd_layer(torch.cat([center, aggr], dim=0))
-                    updates.append(update_dst)
-                    centers.append(dst_idx)
-                
-                centers = torch.tensor(centers, device=dst_feat.device)
-                updates = torch.stack(updates, dim=0)
+                csr, order = csrs[edge_type]
+                centers, nbr_idx, edge_idx, star_mask = sample_stars(csr, self.graphlet_size - 1, order)
+                # Centers index the destination rows, neighbors the source rows stacked after them,
+                # so the stars go through the same size-bucketed call as the homogeneous models
+                node_features = torch.cat([dst_feat, src_feat], dim=0)
+                aggr = quantum_messages(q_layer, node_features, edge_attr, centers,
+                                        nbr_idx + dst_feat.shape[0], edge_idx, star_mask)
+                updates = upd_layer(torch.cat([dst_feat[centers], aggr], dim=1))
                 updates_node = torch.zeros_like(dst_feat)
                 updates_node = updates_node.index_add(0, centers, updates)
                 
@@ -464,12 +572,23 @@ class QGNN_HetNodeClassifier(nn.Module):
     
 class QGNNNodeClassifier(nn.Module):
     def __init__(self, q_dev, w_shapes, hidden_dim, node_input_dim=1, edge_input_dim=1,
-                 graphlet_size=4, hop_neighbor=1, num_classes=2, one_hot=0):
+                 graphlet_size=4, hop_neighbor=1, num_classes=2, one_hot=0,
+                 backend='pennylane', sim_options=None, checkpoint_hops=False, sampling_seed=None,
+                 star_planner='sample'):
         super().__init__()
         self.hidden_dim = hidden_dim
         self.graphlet_size = graphlet_size
         self.one_hot = one_hot
         self.hop_neighbor = hop_neighbor
+        # Recompute each hop in backward instead of keeping its quantum states
+        self.checkpoint_hops = checkpoint_hops
+        # Seeds center order and neighbor sampling (None: global RNG)
+        self.sampling_seed = sampling_seed
+        self._sampler = None
+        # 'sample': random neighbors per destination; 'cover': plan_graphlets coverage stars
+        if star_planner not in ('sample', 'cover'):
+            raise ValueError(f"Unknown star planner '{star_planner}'")
+        self.star_planner = star_planner
         self.pqc_dim = 2 # number of feat per pqc for each node
         self.chunk = 1
         self.final_dim = self.pqc_dim * self.chunk # 2
@@ -505,8 +624,7 @@ class QGNNNodeClassifier(nn.Module):
             )
         
         for i in range(self.hop_neighbor):
-            qnode = qml.QNode(qgcn_enhance_layer, q_dev,  interface="torch")
-            self.qconvs[f"lay{i+1}"] = qml.qnn.TorchLayer(qnode, w_shapes, uniform_pi_init)
+            self.qconvs[f"lay{i+1}"] = make_qconv(q_dev, w_shapes, backend, sim_options)
             
             self.upds[f"lay{i+1}"] = MLP(
                     [self.pqc_dim + self.pqc_out, self.hidden_dim, self.pqc_dim],
@@ -523,17 +641,21 @@ class QGNNNodeClassifier(nn.Module):
                 dropout=0.1
         ) 
         
-    def sampling_neighbors(self, neighbor_ids, edge_ids):
-        # if neighbor_ids.numel() == 0:
-        #     return neighbor_ids, edge_ids
+    def hop(self, i, node_features, edge_features, centers, nbr_idx, edge_idx, star_mask):
+        # One message-passing hop on pre-sampled stars
+        q_layer = self.qconvs[f"lay{i+1}"]
+        upd_layer = self.upds[f"lay{i+1}"]
+        norm_layer = self.norms[f"lay{i+1}"]
+        aggr = quantum_messages(q_layer, node_features, edge_features, centers, nbr_idx, edge_idx, star_mask)
+        updates = upd_layer(torch.cat([node_features[centers], aggr], dim=1))
+        updates_node = torch.zeros_like(node_features)
+        updates_node = updates_node.index_add(0, centers, updates)
+
+        # node_features = norm_layer(updates_node + node_features)
+        # node_features = updates_node + node_features
+        # node_features = F.relu(norm_layer(updates_node + node_features)) # Add ReLU
+        return norm_layer(updates_node + node_features) # No ReLU
 
-        if neighbor_ids.numel() > self.graphlet_size - 1:
-            perm = torch.randperm(neighbor_ids.numel())[:self.graphlet_size - 1]
-            neighbor_ids = neighbor_ids[perm]
-            edge_ids = edge_ids[perm]
-            
-        return neighbor_ids, edge_ids
-        
     def forward(self, node_feat, edge_attr, edge_index, batch):
         edge_index = edge_index.t()
         num_nodes = node_feat.size(0)
@@ -553,48 +675,27 @@ class QGNNNodeClassifier(nn.Module):
         # # node_features = node_features + 0.01 * torch.randn_like(node_features)
         edge_features = input_process(edge_features)
         
-        
+        # Neighbor index and center order are shared by all hops
+        if self.star_planner == 'cover':
+            self._sampler = seeded_generator(self._sampler, self.sampling_seed, 'cpu')
+            adjacency = adjacency_csr(edge_index, num_nodes)
+        else:
+            self._sampler = seeded_generator(self._sampler, self.sampling_seed, edge_index.device)
+            csr = build_csr(edge_index)
+            order = star_order(csr, self._sampler)
         for i in range(self.hop_neighbor):
             q_layer = self.qconvs[f"lay{i+1}"]
-            upd_layer = self.upds[f"lay{i+1}"]
-            norm_layer = self.norms[f"lay{i+1}"]
             
-            centers = []
-            updates = []
-            
-            dst_indices = torch.unique(edge_index[:,1])
-            perm = torch.randperm(dst_indices.shape[0])
-            dst_indices = dst_indices[perm].tolist()
-            for center in dst_indices:
-                neighbor_mask = (edge_index[:,1] == center)
-                neighbor_ids = edge_index[:,0][neighbor_mask]
-                edge_ids = torch.nonzero(neighbor_mask, as_tuple=False).squeeze()
-                neighbor_ids, edge_ids  = self.sampling_neighbors(neighbor_ids, edge_ids)
-                
-                
-                center_ft = node_features[center]
-                neighbors = node_features[neighbor_ids]
-                n_feat = torch.cat([center_ft.unsqueeze(0), neighbors], dim=0)
-                e_feat = edge_features[edge_ids.view(-1)]
-                # e_feat = torch.ones_like(e_feat)
-                inputs = torch.cat([e_feat, n_feat], dim=0)     
-
-                all_msg = q_layer(inputs.flatten())
-                aggr = all_msg
-                update_vec = upd_layer(torch.cat([node_features[center], aggr], dim=0))
-            
-                centers.append(center)
-                updates.append(update_vec)
-            
-            centers = torch.tensor(centers, device=node_features.device)
-            updates = torch.stack(updates, dim=0) 
-            updates_node = torch.zeros_like(node_features)
-            updates_node = updates_node.index_add(0, centers, updates)
-            
-            # node_features = norm_layer(updates_node + node_features)    
-            # node_features = updates_node + node_features
-            # node_features = F.relu(norm_layer(updates_node + node_features)) # Add ReLU
-            node_features = norm_layer(updates_node + node_features) # No ReLU
+            if self.star_planner == 'cover':
+                centers, nbr_idx, edge_idx, star_mask = cover_stars(adjacency, self.graphlet_size - 1, self._sampler,
+                                                                    edge_index.device)
+            else:
+                centers, nbr_idx, edge_idx, star_mask = sample_stars(csr, self.graphlet_size - 1, order, self._sampler)
+            stars = (node_features, edge_features, centers, nbr_idx, edge_idx, star_mask)
+            if self.checkpoint_hops and torch.is_grad_enabled():
+                node_features = checkpoint_hop(self.hop, q_layer, i, *stars)
+            else:
+                node_features = self.hop(i, *stars)
         node_features = F.sigmoid(node_features)
 
         return self.final_layer(node_features)
@@ -603,12 +704,15 @@ class QGNNNodeClassifier(nn.Module):
 ##
 class QGNN_MUTAG(nn.Module):
     def __init__(self, q_dev, w_shapes, hidden_dim, node_input_dim=1, edge_input_dim=1,
-                 graphlet_size=4, hop_neighbor=1, num_classes=2, one_hot=0):
+                 graphlet_size=4, hop_neighbor=1, num_classes=2, one_hot=0,
+                 backend='pennylane', sim_options=None, sampling_seed=None):
         super().__init__()
         self.hidden_dim = hidden_dim
         self.graphlet_size = graphlet_size
         self.one_hot = one_hot
         self.hop_neighbor = hop_neighbor
+        self.sampling_seed = sampling_seed
+        self._sampler = None
         self.pqc_dim = 2 # number of feat per pqc for each node
         self.chunk = 1
         self.final_dim = self.pqc_dim * self.chunk # 2
@@ -642,8 +746,7 @@ class QGNN_MUTAG(nn.Module):
             )
         
         for i in range(self.hop_neighbor):
-            qnode = qml.QNode(qgcn_enhance_layer, q_dev,  interface="torch")
-            self.qconvs[f"lay{i+1}"] = qml.qnn.TorchLayer(qnode, w_shapes, uniform_pi_init)
+            self.qconvs[f"lay{i+1}"] = make_qconv(q_dev, w_shapes, backend, sim_options)
             
             self.upds[f"lay{i+1}"] = MLP(
                     [self.pqc_dim + self.pqc_out, self.hidden_dim, self.pqc_dim],
@@ -660,14 +763,6 @@ class QGNN_MUTAG(nn.Module):
                 dropout=0.1
         ) 
         
-    def sampling_neighbors(self, neighbor_ids, edge_ids):
-        if neighbor_ids.numel() > self.graphlet_size - 1:
-            perm = torch.randperm(neighbor_ids.numel())[:self.graphlet_size - 1]
-            neighbor_ids = neighbor_ids[perm]
-            edge_ids = edge_ids[perm]
-            
-        return neighbor_ids, edge_ids
-        
     def forward(self, node_feat, edge_attr, edge_index, batch):
         edge_index = edge_index.t()
         num_nodes = node_feat.size(0)
@@ -684,39 +779,17 @@ class QGNN_MUTAG(nn.Module):
         node_features = input_process(node_features)
         edge_features = input_process(edge_features)
         
+        self._sampler = seeded_generator(self._sampler, self.sampling_seed, edge_index.device)
+        csr = build_csr(edge_index)
+        order = star_order(csr, self._sampler)
         for i in range(self.hop_neighbor):
             q_layer = self.qconvs[f"lay{i+1}"]
             upd_layer = self.upds[f"lay{i+1}"]
             norm_layer = self.norms[f"lay{i+1}"]
 
-            centers = []
-            updates = []
-            
-            dst_indices = torch.unique(edge_index[:,1])
-            perm = torch.randperm(dst_indices.shape[0])
-            dst_indices = dst_indices[perm].tolist()
-            for center in dst_indices:
-                neighbor_mask = (edge_index[:,1] == center)
-                neighbor_ids = edge_index[:,0][neighbor_mask]
-                edge_ids = torch.nonzero(neighbor_mask, as_tuple=False).squeeze()
-                neighbor_ids, edge_ids  = self.sampling_neighbors(neighbor_ids, edge_ids)
-                
-                
-                center_ft = node_features[center]
-                neighbors = node_features[neighbor_ids]
-                n_feat = torch.cat([center_ft.unsqueeze(0), neighbors], dim=0)
-                e_feat = edge_features[edge_ids.view(-1)]
-                inputs = torch.cat([e_feat, n_feat], dim=0)     
-
-                all_msg = q_layer(inputs.flatten())
-                aggr = all_msg
-                update_vec = upd_layer(torch.cat([node_features[center], aggr], dim=0))
-            
-                centers.append(center)
-                updates.append(update_vec)
-            
-            centers = torch.tensor(centers, device=node_features.device)
-            updates = torch.stack(updates, dim=0) 
+            centers, nbr_idx, edge_idx, star_mask = sample_stars(csr, self.graphlet_size - 1, order, self._sampler)
+            aggr = quantum_messages(q_layer, node_features, edge_features, centers, nbr_idx, edge_idx, star_mask)
+            updates = upd_layer(torch.cat([node_features[centers], aggr], dim=1))
             updates_node = torch.zeros_like(node_features)
             updates_node = updates_node.index_add(0, centers, updates)
             
@@ -5,7 +5,7 @@ from pennylane import numpy as np
 import torch.nn.functional as F
 from torch_geometric.nn import MLP, global_add_pool, global_mean_pool, global_max_pool   
 
-from utils import star_subgraph
+from utils import adjacency_csr, plan_graphlets
 
 
 def message_passing_pqc(strong, twodesign, inits, wires):
@@ -193,19 +193,11 @@ class QGNNGraphClassifier(nn.Module):
         edge_features = input_process(edge_features)
         
         
-        idx_dict = {
-            (int(u), int(v)): i
-            for i, (u, v) in enumerate(edge_index.tolist())
-        }
-        
-
-        adj_mtx = torch.zeros((num_nodes, num_nodes), dtype=torch.int)
-        adj_mtx[edge_index[:, 0], edge_index[:, 1]] = 1
-        adj_mtx[edge_index[:, 1], edge_index[:, 0]] = 1
+        adjacency = adjacency_csr(edge_index, num_nodes)
         
         
         for i in range(self.hop_neighbor):
-            subgraphs = star_subgraph(adj_mtx.cpu().numpy(), subgraph_size=self.graphlet_size)
+            stars = plan_graphlets(adjacency, self.graphlet_size - 1)
             node_upd = torch.zeros((num_nodes, self.final_dim), device=node_features.device)
             q_layer = self.qconvs[f"lay{i+1}"]
             upd_layer = self.upds[f"lay{i+1}"]
@@ -216,16 +208,12 @@ class QGNNGraphClassifier(nn.Module):
             centers = []
             updates = []
             
-            for sub in subgraphs:
-                center, *neighbors = sub
+            for center, nbrs, edge_idxs, occupied in zip(*stars):
+                center = int(center)
+                sub = [center] + nbrs[occupied].tolist()
 
                 n_feat = node_features[sub] 
-                # edge_idxs = [ idx_dict[(center, int(n))] for n in neighbors ]
-                edge_idxs = [
-                    idx_dict[(min(center, int(n)), max(center, int(n)))] 
-                    for n in neighbors 
-                ]
-                e_feat    = edge_features[edge_idxs]  
+                e_feat    = edge_features[edge_idxs[occupied].to(edge_features.device)]  
                 inputs = torch.cat([e_feat, n_feat], dim=0)        
 
                 all_msg = q_layer(inputs.flatten())
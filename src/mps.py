@@ -0,0 +1,217 @@
+import torch
+
+from qsim import COMPLEX, star_wires, star_amplitudes, masked_matrix, real_dtype, update_stat
+
+
+# Matrix-product-state engine for star circuits whose width rules out a
+# statevector. The state lives on a chain of qubits; two-qubit gates on
+# non-neighboring wires are routed with SWAPs and every split is an SVD
+# truncated to ``max_bond``. The readout block walks along the chain of
+# (edge, neighbor) pairs (``chain_order``), which bounds every bond by 16. The discarded weight of every truncation is
+# accumulated per star as the reported truncation error.
+
+
+class SafeSVD(torch.autograd.Function):
+    """Complex SVD with a broadened backward pass.
+
+    MPS tensors are full of (near) degenerate singular values, e.g. every product
+    state, where the textbook 1 / (s_j^2 - s_i^2) and 1 / s_i terms blow up.
+    Both are replaced by x / (x^2 + eps).
+    """
+
+    @staticmethod
+    def forward(ctx, a, eps):
+        u, s, vh = torch.linalg.svd(a, full_matrices=False)
+        ctx.save_for_backward(u, s, vh)
+        ctx.eps = eps
+        return u, s, vh
+
+    @staticmethod
+    def backward(ctx, gu, gs, gvh):
+        u, s, vh = ctx.saved_tensors
+        eps = ctx.eps
+        dtype = u.dtype
+        m, k, n = u.shape[-2], s.shape[-1], vh.shape[-1]
+        gu = torch.zeros_like(u) if gu is None else gu
+        gs = torch.zeros_like(s) if gs is None else gs
+        gvh = torch.zeros_like(vh) if gvh is None else gvh
+
+        uhgu = u.mH @ gu
+        vhgv = vh @ gvh.mH
+        s2 = s * s
+        e = s2.unsqueeze(-2) - s2.unsqueeze(-1)
+        f = (e / (e * e + eps)).to(dtype)
+        sc = s.to(dtype)
+        inner = f * ((uhgu - uhgu.mH) * sc.unsqueeze(-2) + sc.unsqueeze(-1) * (vhgv - vhgv.mH))
+        s_inv = s / (s2 + eps)
+        phase = (uhgu.diagonal(dim1=-2, dim2=-1).imag - vhgv.diagonal(dim1=-2, dim2=-1).imag) * s_inv / 2
+        inner = inner + torch.diag_embed(gs.to(dtype) + 1j * phase.to(dtype))
+
+        ga = u @ inner @ vh
+        s_inv = s_inv.to(dtype)
+        if m > k:
+            ga = ga + ((gu - u @ uhgu) * s_inv.unsqueeze(-2)) @ vh
+        if n > k:
+            ga = ga + u @ (s_inv.unsqueeze(-1) * (gvh - (gvh @ vh.mH) @ vh))
+        return ga, None
+
+
+# Broadening of the SVD backward per precision: wide enough to keep degenerate spectra
+# finite, narrow enough that gradients stay exact to round-off
+SVD_EPS = {torch.complex64: 1e-12, torch.complex128: 1e-20}
+
+
+def safe_svd(a, eps=None):
+    return SafeSVD.apply(a, SVD_EPS.get(a.dtype, 1e-12) if eps is None else eps)
+
+
+def swap_matrix(cdtype=COMPLEX, device=None):
+    return torch.tensor([[1, 0, 0, 0],
+                         [0, 0, 1, 0],
+                         [0, 1, 0, 0],
+                         [0, 0, 0, 1]], dtype=cdtype, device=device)
+
+
+class MatrixProductState:
+    """Batched MPS (B stars at once) kept in mixed canonical form."""
+
+    def __init__(self, amplitudes, order, max_bond=16, tol=None):
+        # amplitudes: (B, n_wires, 2) product state; order: wire at each chain position
+        batch = amplitudes.shape[0]
+        self.order = list(order)
+        self.pos = {wire: p for p, wire in enumerate(self.order)}
+        self.tensors = [amplitudes[:, wire].reshape(batch, 1, 2, 1) for wire in self.order]
+        self.center = 0
+        self.max_bond = max_bond
+        # Relative cutoff for numerically zero singular values
+        self.tol = tol if tol is not None else (1e-6 if amplitudes.dtype == torch.complex64 else 1e-12)
+        self.error = torch.zeros(batch, dtype=real_dtype(amplitudes.dtype), device=amplitudes.device)
+
+    def _rank(self, s, limit):
+        with torch.no_grad():
+            rank = int((s > self.tol * s[..., :1]).sum(-1).max())
+        return max(1, min(rank, limit))
+
+    def _move_center(self, target):
+        while self.center < target:
+            p = self.center
+            a = self.tensors[p]
+            batch, left, _, right = a.shape
+            u, s, vh = safe_svd(a.reshape(batch, left * 2, right))
+            keep = self._rank(s, s.shape[-1])
+            self.tensors[p] = u[..., :keep].reshape(batch, left, 2, keep)
+            rest = s[..., :keep].to(a.dtype).unsqueeze(-1) * vh[:, :keep]
+            self.tensors[p + 1] = torch.einsum('bkr,brsz->bksz', rest, self.tensors[p + 1])
+            self.center += 1
+        while self.center > target:
+            p = self.center
+            a = self.tensors[p]
+            batch, left, _, right = a.shape
+            u, s, vh = safe_svd(a.reshape(batch, left, 2 * right))
+            keep = self._rank(s, s.shape[-1])
+            self.tensors[p] = vh[:, :keep].reshape(batch, keep, 2, right)
+            rest = u[..., :keep] * s[..., :keep].to(a.dtype).unsqueeze(-2)
+            self.tensors[p - 1] = torch.einsum('bxsl,blk->bxsk', self.tensors[p - 1], rest)
+            self.center -= 1
+
+    def _apply_pair(self, matrix, p):
+        # matrix acts on chain positions (p, p + 1), first position = most significant
+        self._move_center(p)
+        a, b = self.tensors[p], self.tensors[p + 1]
+        batch, left = a.shape[0], a.shape[1]
+        right = b.shape[-1]
+        theta = torch.einsum('bxsy,bytz->bxstz', a, b)
+        gate = matrix.expand(batch, 4, 4).reshape(batch, 2, 2, 2, 2)
+        theta = torch.einsum('bijst,bxstz->bxijz', gate, theta)
+
+        u, s, vh = safe_svd(theta.reshape(batch, left * 2, 2 * right))
+        keep = self._rank(s, self.max_bond)
+        with torch.no_grad():
+            total = (s * s).sum(-1)
+            self.error += (s[:, keep:] ** 2).sum(-1) / total
+        s = s[:, :keep]
+        s = s / torch.linalg.vector_norm(s, dim=-1, keepdim=True)
+        self.tensors[p] = u[..., :keep].reshape(batch, left, 2, keep)
+        self.tensors[p + 1] = (s.to(a.dtype).unsqueeze(-1) * vh[:, :keep]).reshape(batch, keep, 2, right)
+        self.center = p + 1
+
+    def _swap(self, p):
+        # Exchange the wires at chain positions (p, p + 1)
+        tensor = self.tensors[p]
+        self._apply_pair(swap_matrix(tensor.dtype, tensor.device), p)
+        left, right = self.order[p], self.order[p + 1]
+        self.order[p], self.order[p + 1] = right, left
+        self.pos[left], self.pos[right] = p + 1, p
+
+    def reorder(self, order):
+        # Bring the chain into ``order`` with nearest-neighbor SWAPs
+        for goal, wire in enumerate(order):
+            while self.pos[wire] > goal:
+                self._swap(self.pos[wire] - 1)
+
+    def apply(self, matrix, wires):
+        batch = self.tensors[0].shape[0]
+        if len(wires) == 1:
+            p = self.pos[wires[0]]
+            gate = matrix.expand(batch, 2, 2)
+            self.tensors[p] = torch.einsum('bst,bxty->bxsy', gate, self.tensors[p])
+            return
+        if len(wires) != 2:
+            raise ValueError(f"MPS engine applies 1- and 2-qubit gates only, got {len(wires)} wires")
+        a, b = wires
+        # Route ``b`` next to ``a`` with nearest-neighbor SWAPs
+        while abs(self.pos[a] - self.pos[b]) > 1:
+            q = self.pos[b]
+            self._swap(q - 1 if self.pos[a] < q else q)
+        if self.pos[a] > self.pos[b]:
+            swap = swap_matrix(matrix.dtype, matrix.device)
+            matrix = swap @ matrix @ swap
+        self._apply_pair(matrix, min(self.pos[a], self.pos[b]))
+
+    def probs(self, wires):
+        # Marginal distribution over ``wires`` (first wire = most significant bit)
+        batch = self.tensors[0].shape[0]
+        env = torch.ones(batch, 1, 1, 1, dtype=self.tensors[0].dtype, device=self.tensors[0].device)
+        bits = []
+        for p, tensor in enumerate(self.tensors):
+            if self.order[p] in wires:
+                env = torch.einsum('boxy,bxsz,bysw->boszw', env, tensor, tensor.conj())
+                env = env.reshape(batch, -1, *env.shape[-2:])
+                bits.append(self.order[p])
+            else:
+                env = torch.einsum('boxy,bxsz,bysw->bozw', env, tensor, tensor.conj())
+        probs = env.reshape(batch, *([2] * len(bits))).real
+        probs = probs.permute(0, *[1 + bits.index(w) for w in wires]).reshape(batch, -1)
+        return probs / probs.sum(-1, keepdim=True)
+
+
+def chain_order(num_slots, slot=0):
+    """Chain layout while the update layers of ``slot`` run.
+
+    Every (edge_i, neighbor_i) pair stays adjacent and the (center, anc1, anc2)
+    block sits right after the pair of ``slot``. Only the block moves between
+    slots, past one pair at a time, so no bond exceeds the four qubits of the
+    active window (dimension 16) at any number of slots.
+    """
+    center, anc1, anc2 = star_wires(num_slots)
+    pairs = [[i, center + 1 + i] for i in range(num_slots)]
+    return sum(pairs[:slot + 1], []) + [center, anc1, anc2] + sum(pairs[slot + 1:], [])
+
+
+def mps_probs(ops, edge_q, node_q, mask, cdtype=COMPLEX, max_bond=16, stats=None):
+    """(center, anc1, anc2) probabilities from an MPS simulation with bond dimension <= ``max_bond``."""
+    num_slots = mask.shape[1]
+    readout = set(star_wires(num_slots))
+    amps = star_amplitudes(edge_q, node_q, cdtype)
+    state = MatrixProductState(amps, chain_order(num_slots), max_bond)
+    placed = 0
+    for op in ops:
+        # The readout block walks to the pair of each slot before its update layers
+        if op.slot is not None and op.slot != placed and readout & set(op.wires):
+            state.reorder(chain_order(num_slots, op.slot))
+            placed = op.slot
+        matrix = op.matrix if op.slot is None else masked_matrix(op.matrix, mask[:, op.slot])
+        state.apply(matrix, op.wires)
+    if stats is not None:
+        update_stat(stats, 'truncation_error', max, float(state.error.max()))
+    return state.probs(star_wires(num_slots))
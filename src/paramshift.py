@@ -0,0 +1,172 @@
+import math
+import operator
+
+import torch
+
+from qsim import COMPLEX, BARRIER, gate_matrix, encoded_qubits, encoded_state, apply_matrix, \
+    marginal_probs, star_wires, update_stat
+
+
+# Parameter-shift gradients for the star circuit, as a hardware would compute
+# them: every derivative is a weighted sum of circuit evaluations at shifted
+# parameters. Shifted circuits are evaluated as one broadcast batch: a shifted
+# weight is shared by all stars, so each shift is run once for the whole bucket
+# of stars (rows = shifts x stars). Stars are bucketed by neighbor count
+# before they get here, so gates of empty slots are never shifted. A weight
+# shared by several gates (``inits`` and ``strong`` are reused by every slot) is
+# shifted once per gate: the shift rules are exact only for a single gate's
+# generator. Those repeated shifts are counted separately in ``stats``.
+
+# (coefficient, shift) terms of d f / d theta
+TWO_TERM = ((0.5, math.pi / 2), (-0.5, -math.pi / 2))
+_C_PLUS, _C_MINUS = (math.sqrt(2) + 1) / (4 * math.sqrt(2)), (math.sqrt(2) - 1) / (4 * math.sqrt(2))
+# Controlled rotations have eigenvalues {0, +-1/2} and need four terms
+FOUR_TERM = ((_C_PLUS, math.pi / 2), (-_C_PLUS, -math.pi / 2),
+             (-_C_MINUS, 3 * math.pi / 2), (_C_MINUS, -3 * math.pi / 2))
+
+
+def shift_rule(name):
+    return FOUR_TERM if name in ('CRX', 'CRY') else TWO_TERM
+
+
+class ShiftCircuit:
+    """Gates of one bucket of stars, evaluated for batches of parameter sets and input angles."""
+
+    def __init__(self, gates, num_slots, cdtype=COMPLEX, max_rows=None, sampler=None):
+        self.gates = [gate for gate in gates if gate.name != BARRIER]
+        self.num_slots = num_slots
+        self.cdtype = cdtype
+        self.max_rows = max_rows
+        self.sampler = sampler
+        self.offsets = [0]
+        for gate in self.gates:
+            self.offsets.append(self.offsets[-1] + len(gate.params))
+        # Weight element behind every entry of ``values()``: bound gates hold views of the
+        # layer's flat weights, so equal (base, offset) pairs are the same weight
+        self.owners = [(id(p._base), p.storage_offset()) if p._base is not None else id(p)
+                       for gate in self.gates for p in gate.params]
+
+    def values(self):
+        # Flat (P,) tensor of all gate parameters, differentiable w.r.t. the weights
+        params = [p for gate in self.gates for p in gate.params]
+        return torch.stack(params) if params else torch.zeros(0)
+
+    def rules(self):
+        # Shift rule of every entry of ``values()``
+        return [shift_rule(gate.name) for gate in self.gates for _ in gate.params]
+
+    def run(self, values, edge_x, node_x, sample=True):
+        """(C, B, 8) probabilities for C parameter sets (C, P) and angles (C, B, ., 2)."""
+        num_sets, batch = edge_x.shape[:2]
+        device = edge_x.device
+        edge_q = encoded_qubits(edge_x.flatten(0, 1), self.cdtype)
+        node_q = encoded_qubits(node_x.flatten(0, 1), self.cdtype)
+        state = encoded_state(edge_q, node_q, self.cdtype)
+        for gate, start, stop in zip(self.gates, self.offsets, self.offsets[1:]):
+            params = tuple(values[:, start:stop].unbind(1))
+            matrix = gate_matrix(gate._replace(params=params), self.cdtype, device)
+            if matrix.dim() == 3:
+                matrix = matrix.repeat_interleave(batch, dim=0)
+            state = apply_matrix(state, matrix, gate.wires)
+        probs = marginal_probs(state, star_wires(self.num_slots))
+        if sample and self.sampler is not None:
+            probs = self.sampler(probs)
+        return probs.reshape(num_sets, batch, -1)
+
+    def run_chunked(self, values, edge_x, node_x):
+        batch = edge_x.shape[1]
+        step = max(1, (self.max_rows or values.shape[0] * batch) // batch)
+        return torch.cat([self.run(values[s:s + step], edge_x[s:s + step], node_x[s:s + step])
+                          for s in range(0, values.shape[0], step)], dim=0)
+
+    def weight_grad(self, values, edge_x, node_x, grad_probs):
+        # Returns the gradient, the circuits run, and how many of them shift an
+        # already shifted weight in another gate
+        coeffs, rows, shared, seen = [], [], 0, set()
+        for k, rule in enumerate(self.rules()):
+            if self.owners[k] in seen:
+                shared += len(rule)
+            seen.add(self.owners[k])
+            for coeff, shift in rule:
+                shifted = values.clone()
+                shifted[k] += shift
+                coeffs.append(coeff)
+                rows.append(shifted)
+        if not rows:
+            return values.new_zeros(values.shape), 0, 0
+        sets = torch.stack(rows)
+        probs = self.run_chunked(sets, edge_x.expand(len(rows), *edge_x.shape), node_x.expand(len(rows), *node_x.shape))
+        # d L / d shifted circuit, reduced over stars: (C,)
+        evals = torch.einsum('cbo,bo->c', probs, grad_probs.to(probs.dtype))
+        coeffs = torch.tensor(coeffs, dtype=evals.dtype, device=evals.device)
+        grad = torch.zeros(values.shape[0], dtype=evals.dtype, device=evals.device)
+        owner = torch.tensor([k for k, rule in enumerate(self.rules()) for _ in rule], device=evals.device)
+        return grad.index_add(0, owner, coeffs * evals), len(rows) * edge_x.shape[0], shared * edge_x.shape[0]
+
+    def input_grad(self, values, edge_x, node_x, grad_probs, which='edge'):
+        # Every (position, component) of the RX/RZ angles is shifted for all stars at once
+        x = edge_x if which == 'edge' else node_x
+        positions = [(i, j) for i in range(x.shape[1]) for j in range(x.shape[2])]
+        if not positions:
+            return torch.zeros_like(x), 0
+        shifted = []
+        for i, j in positions:
+            for _, shift in TWO_TERM:
+                angles = x.clone()
+                angles[:, i, j] += shift
+                shifted.append(angles)
+        shifted = torch.stack(shifted)
+        if which == 'edge':
+            edge_sets, node_sets = shifted, node_x.expand(len(shifted), *node_x.shape)
+        else:
+            edge_sets, node_sets = edge_x.expand(len(shifted), *edge_x.shape), shifted
+        probs = self.run_chunked(values.expand(len(shifted), *values.shape), edge_sets, node_sets)
+        # Per star this time: (positions, terms, B)
+        evals = torch.einsum('cbo,bo->cb', probs, grad_probs.to(probs.dtype))
+        evals = evals.reshape(len(positions), len(TWO_TERM), -1)
+        coeffs = torch.tensor([coeff for coeff, _ in TWO_TERM], dtype=evals.dtype, device=evals.device)
+        grad = torch.einsum('psb,s->bp', evals, coeffs).reshape(x.shape)
+        return grad.to(x.dtype), len(shifted) * x.shape[0]
+
+
+class ParameterShift(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, values, edge_x, node_x, circuit, stats):
+        ctx.circuit, ctx.stats = circuit, stats
+        ctx.save_for_backward(values, edge_x, node_x)
+        # Shot noise of the forward pass is added by the caller
+        return circuit.run(values.unsqueeze(0), edge_x.unsqueeze(0), node_x.unsqueeze(0), sample=False)[0]
+
+    @staticmethod
+    def backward(ctx, grad_probs):
+        values, edge_x, node_x = ctx.saved_tensors
+        circuit, stats = ctx.circuit, ctx.stats
+        grad_values = grad_edge = grad_node = None
+        executed = shared = 0
+        if ctx.needs_input_grad[0]:
+            grad_values, count, shared = circuit.weight_grad(values, edge_x, node_x, grad_probs)
+            grad_values, executed = grad_values.to(values.dtype), executed + count
+        if ctx.needs_input_grad[1]:
+            grad_edge, count = circuit.input_grad(values, edge_x, node_x, grad_probs, 'edge')
+            executed += count
+        if ctx.needs_input_grad[2]:
+            grad_node, count = circuit.input_grad(values, edge_x, node_x, grad_probs, 'node')
+            executed += count
+        if stats is not None:
+            update_stat(stats, 'circuits', operator.add, executed)
+            update_stat(stats, 'shared_circuits', operator.add, shared)
+        return grad_values, grad_edge, grad_node, None, None
+
+
+def shift_probs(gates, edge_x, node_x, mask, cdtype=COMPLEX, stats=None, max_rows=None):
+    """(center, anc1, anc2) probabilities whose backward pass uses parameter-shift rules.
+
+    ``gates`` are the symbolic gates of stars with every slot occupied and
+    ``edge_x``/``node_x`` the RX/RZ angles (not encoded qubits).
+    """
+    num_slots = mask.shape[1]
+    sampler = stats.get('sampler') if stats is not None else None
+    circuit = ShiftCircuit(gates, num_slots, cdtype, max_rows, sampler)
+    if stats is not None:
+        update_stat(stats, 'circuits', operator.add, mask.shape[0])
+    return ParameterShift.apply(circuit.values(), edge_x, node_x, circuit, stats)
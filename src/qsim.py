@@ -0,0 +1,973 @@
+import math
+import threading
+from collections import namedtuple, defaultdict
+from contextlib import nullcontext
+
+import torch
+import torch.nn as nn
+from torch.profiler import record_function
+
+
+# Torch-native simulation of the star circuit built by ``qgcn_enhance_layer``.
+#
+# Wire layout follows the PennyLane circuit for a star with ``num_slots``
+# neighbor slots (``num_slots = graphlet_size - 1``):
+#   edge i      -> wire i
+#   center      -> wire num_slots
+#   neighbor i  -> wire num_slots + 1 + i
+#   ancillas    -> wires 2*num_slots + 1, 2*num_slots + 2
+# Stars with fewer neighbors are padded; every gate that belongs to an empty
+# slot is replaced by the identity through ``mask``.
+
+COMPLEX = torch.complex128
+# Simulation precision policies; weights and features are cast once at the layer boundary
+PRECISIONS = {'single': torch.complex64, 'double': torch.complex128}
+
+# Symbolic gate: ``params`` are (differentiable) scalars, ``slot`` is the
+# neighbor slot the gate belongs to (None = always applied).
+Gate = namedtuple('Gate', ['name', 'wires', 'params', 'slot'])
+# Compiled gate: dense matrix over ``wires`` (first wire = most significant bit).
+Op = namedtuple('Op', ['wires', 'matrix', 'slot'])
+
+# Noise channel after an entangling block: applied to each of ``wires`` by the
+# trajectory engine, a fusion barrier for everything else.
+Channel = namedtuple('Channel', ['wires', 'slot'])
+
+# Gates are never fused across a barrier
+BARRIER = 'Barrier'
+NOISE = 'Noise'
+# Widest fused unitary each engine accepts
+FUSION_WIDTHS = {'statevector': 4, 'rdm': 4, 'mps': 2, 'pauli': 2}
+
+
+def real_dtype(cdtype):
+    return torch.float32 if cdtype == torch.complex64 else torch.float64
+
+
+def _half_angle(theta, cdtype):
+    theta = theta.to(real_dtype(cdtype)) / 2
+    return torch.cos(theta).to(cdtype), torch.sin(theta).to(cdtype)
+
+
+def rx_matrix(theta, cdtype=COMPLEX):
+    c, s = _half_angle(theta, cdtype)
+    return torch.stack([c, -1j * s, -1j * s, c], dim=-1).reshape(*theta.shape, 2, 2)
+
+
+def ry_matrix(theta, cdtype=COMPLEX):
+    c, s = _half_angle(theta, cdtype)
+    return torch.stack([c, -s, s, c], dim=-1).reshape(*theta.shape, 2, 2)
+
+
+def rz_matrix(theta, cdtype=COMPLEX):
+    phase = torch.exp(-0.5j * theta.to(real_dtype(cdtype)).to(cdtype))
+    zero = torch.zeros_like(phase)
+    return torch.stack([phase, zero, zero, phase.conj()], dim=-1).reshape(*theta.shape, 2, 2)
+
+
+def rot_matrix(phi, theta, omega, cdtype=COMPLEX):
+    # qml.Rot(phi, theta, omega) = RZ(omega) RY(theta) RZ(phi)
+    c, s = _half_angle(theta, cdtype)
+    rdtype = real_dtype(cdtype)
+    plus = torch.exp(-0.5j * (phi + omega).to(rdtype).to(cdtype))
+    minus = torch.exp(-0.5j * (phi - omega).to(rdtype).to(cdtype))
+    mat = torch.stack([plus * c, -minus.conj() * s, minus * s, plus.conj() * c], dim=-1)
+    return mat.reshape(*theta.shape, 2, 2)
+
+
+def controlled(u):
+    out = torch.zeros(*u.shape[:-2], 4, 4, dtype=u.dtype, device=u.device)
+    out[..., 0, 0] = 1
+    out[..., 1, 1] = 1
+    out[..., 2:, 2:] = u
+    return out
+
+
+def cnot_matrix(cdtype=COMPLEX, device=None):
+    return torch.tensor([[1, 0, 0, 0],
+                         [0, 1, 0, 0],
+                         [0, 0, 0, 1],
+                         [0, 0, 1, 0]], dtype=cdtype, device=device)
+
+
+def gate_matrix(gate, cdtype=COMPLEX, device=None):
+    name, params = gate.name, gate.params
+    if name == 'Rot':
+        return rot_matrix(*params, cdtype=cdtype)
+    if name == 'RX':
+        return rx_matrix(params[0], cdtype)
+    if name == 'RY':
+        return ry_matrix(params[0], cdtype)
+    if name == 'RZ':
+        return rz_matrix(params[0], cdtype)
+    if name == 'CRX':
+        return controlled(rx_matrix(params[0], cdtype))
+    if name == 'CRY':
+        return controlled(ry_matrix(params[0], cdtype))
+    if name == 'CNOT':
+        return cnot_matrix(cdtype, device)
+    raise ValueError(f"Unsupported gate: {name}")
+
+
+def entangling_gates(weights, wires, slot=None):
+    # Same decomposition as qml.StronglyEntanglingLayers with default ranges and CNOT
+    gates = []
+    n_wires = len(wires)
+    for l in range(weights.shape[0]):
+        for i, wire in enumerate(wires):
+            gates.append(Gate('Rot', (wire,), (weights[l, i, 0], weights[l, i, 1], weights[l, i, 2]), slot))
+        if n_wires > 1:
+            r = l % (n_wires - 1) + 1
+            for i in range(n_wires):
+                gates.append(Gate('CNOT', (wires[i], wires[(i + r) % n_wires]), (), slot))
+    return gates
+
+
+def star_wires(num_slots):
+    center = num_slots
+    return center, 2 * num_slots + 1, 2 * num_slots + 2
+
+
+def star_program(strong, inits, update, num_slots, noise=False):
+    """Weight-only gates of ``qgcn_enhance_layer`` (message_passing_pqc + update layers).
+
+    With ``noise``, a noise channel follows every entangling block.
+    """
+    center, anc1, anc2 = star_wires(num_slots)
+    gates = []
+    for i in range(num_slots):
+        edge, neighbor = i, center + i + 1
+        gates.append(Gate('CRX', (neighbor, edge), (inits[0, 0],), i))
+        gates.append(Gate('CRY', (edge, neighbor), (inits[0, 1],), i))
+        gates += entangling_gates(strong[0], (edge, neighbor), i)
+        if noise:
+            gates.append(Gate(NOISE, (edge, neighbor), (), i))
+    gates.append(Gate(BARRIER, (), (), None))
+    for i in range(num_slots):
+        wires = (center, center + i + 1, anc1, anc2)
+        gates += entangling_gates(update[i], wires, i)
+        if noise:
+            gates.append(Gate(NOISE, wires, (), i))
+    return gates
+
+
+def compile_program(gates, cdtype=COMPLEX, device=None):
+    return [Channel(gate.wires, gate.slot) if gate.name == NOISE else
+            Op(gate.wires, gate_matrix(gate, cdtype, device), gate.slot)
+            for gate in gates if gate.name != BARRIER]
+
+
+def expand_matrix(matrix, wires, target):
+    # Embed ``matrix`` acting on ``wires`` into the space of ``target`` (a superset of ``wires``)
+    if tuple(wires) == tuple(target):
+        return matrix
+    dim = 2 ** len(target)
+    basis = torch.eye(dim, dtype=matrix.dtype, device=matrix.device).reshape(dim, *([2] * len(target)))
+    columns = apply_matrix(basis, matrix, [target.index(w) for w in wires])
+    return columns.reshape(dim, dim).T
+
+
+def fusion_plan(gates, max_wires=4):
+    """Group ``gates`` into blocks of at most ``max_wires`` wires.
+
+    A gate is merged into a block of the same slot placed after every block it
+    shares a wire with, so the order of non-commuting gates is preserved. Blocks
+    with the smallest resulting width are preferred. Returns Channels and
+    (wires, gate indices, slot) blocks; only gate structure is used, so a plan
+    holds for any parameter values.
+    """
+    blocks = []  # [wires, gate indices, slot] or Channel
+    start = 0
+    for k, gate in enumerate(gates):
+        if gate.name == NOISE:
+            blocks.append(Channel(gate.wires, gate.slot))
+        if gate.name in (BARRIER, NOISE):
+            start = len(blocks)
+            continue
+        wires = set(gate.wires)
+        overlap = [b for b in range(start, len(blocks)) if wires & set(blocks[b][0])]
+        first = overlap[-1] if overlap else max(start, len(blocks) - 1)
+        best, best_size = None, max_wires
+        for b in range(first, len(blocks)):
+            size = len(wires | set(blocks[b][0]))
+            if blocks[b][2] == gate.slot and size <= best_size:
+                best, best_size = b, size
+        if best is None:
+            blocks.append([tuple(gate.wires), [k], gate.slot])
+            continue
+        block_wires, members, slot = blocks[best]
+        target = block_wires + tuple(w for w in gate.wires if w not in block_wires)
+        blocks[best] = [target, members + [k], slot]
+    return [block if isinstance(block, Channel) else tuple(block) for block in blocks]
+
+
+def gate_matrices(gates, values=None, cdtype=COMPLEX, device=None):
+    """Matrices of ``gates``, one batched call per gate type.
+
+    With ``values``, gate parameters are integer ids into this flat tensor (see
+    ``StarCircuitLayer.structure``) and every matrix is built on their device.
+    Barriers and noise markers get None.
+    """
+    if values is not None:
+        device = values.device
+    matrices = [None] * len(gates)
+    by_name = defaultdict(list)
+    for k, gate in enumerate(gates):
+        if gate.name not in (BARRIER, NOISE):
+            by_name[gate.name].append(k)
+    for name, members in by_name.items():
+        if not gates[members[0]].params:
+            matrix = gate_matrix(gates[members[0]], cdtype, device)
+            for k in members:
+                matrices[k] = matrix
+            continue
+        if values is None:
+            params = torch.stack([torch.stack([torch.as_tensor(p) for p in gates[k].params]) for k in members])
+        else:
+            params = values[torch.tensor([gates[k].params for k in members], device=values.device)]
+        batch = gate_matrix(Gate(name, (), tuple(params.unbind(1)), None), cdtype, params.device)
+        for k, matrix in zip(members, batch.unbind(0)):
+            matrices[k] = matrix
+    return matrices
+
+
+def fused_ops(plan, gates, matrices):
+    # Ops of a fusion plan: every block is the product of its gates embedded on the block wires
+    ops = []
+    for block in plan:
+        if isinstance(block, Channel):
+            ops.append(block)
+            continue
+        wires, members, slot = block
+        matrix = None
+        for k in members:
+            gate = expand_matrix(matrices[k], gates[k].wires, wires)
+            matrix = gate if matrix is None else gate @ matrix
+        ops.append(Op(wires, matrix, slot))
+    return ops
+
+
+def fuse_program(gates, max_wires=4, cdtype=COMPLEX, device=None):
+    """Compile ``gates`` into dense unitaries on at most ``max_wires`` wires (see ``fusion_plan``)."""
+    return fused_ops(fusion_plan(gates, max_wires), gates, gate_matrices(gates, cdtype=cdtype, device=device))
+
+
+def narrow_ops(ops, num_slots, width):
+    """Ops of stars with ``width`` occupied slots, remapped to the wire layout of ``width`` slots."""
+    def remap(wire):
+        if wire < num_slots:
+            return wire
+        if wire <= 2 * num_slots:
+            return wire - num_slots + width
+        return wire - 2 * num_slots + 2 * width
+    return [op._replace(wires=tuple(remap(w) for w in op.wires))
+            for op in ops if op.slot is None or op.slot < width]
+
+
+def masked_matrix(matrix, mask):
+    # (B, d, d): ``matrix`` where the slot is occupied, identity elsewhere
+    eye = torch.eye(matrix.shape[-1], dtype=matrix.dtype, device=matrix.device)
+    return torch.where(mask.view(-1, 1, 1), matrix, eye)
+
+
+def apply_matrix(state, matrix, wires):
+    """Apply a (d, d) or per-star (B, d, d) matrix to ``wires`` of a (B, 2, ..., 2) state."""
+    k = len(wires)
+    axes = [w + 1 for w in wires]
+    front = list(range(1, k + 1))
+    state = torch.movedim(state, axes, front)
+    shape = state.shape
+    state = torch.matmul(matrix, state.reshape(shape[0], 2 ** k, -1))
+    return torch.movedim(state.reshape(shape), front, axes)
+
+
+def marginal_probs(state, wires):
+    probs = state.real ** 2 + state.imag ** 2
+    k = len(wires)
+    probs = torch.movedim(probs, [w + 1 for w in wires], list(range(1, k + 1)))
+    return probs.reshape(probs.shape[0], 2 ** k, -1).sum(-1)
+
+
+def z_signs(num_wires, dtype=torch.float64, device=None):
+    # (2**k, k) eigenvalues of PauliZ on each wire for every basis state
+    idx = torch.arange(2 ** num_wires, device=device)
+    bits = (idx.unsqueeze(1) >> torch.arange(num_wires - 1, -1, -1, device=device)) & 1
+    return (1 - 2 * bits).to(dtype)
+
+
+def encoding_wires(num_slots):
+    # edge i on wire i, node j (center first) on wire num_slots + j
+    return list(range(num_slots)), list(range(num_slots, 2 * num_slots + 1))
+
+
+def encoded_qubits(angles, cdtype=COMPLEX):
+    # (..., 2) angles (a, b) -> (..., 2) amplitudes of RZ(b) RX(a) |0> = (cos(a/2) e^{-ib/2}, -i sin(a/2) e^{ib/2})
+    half = angles.to(real_dtype(cdtype)) / 2
+    a, b = half[..., 0], half[..., 1]
+    phase = torch.complex(torch.cos(b), -torch.sin(b))
+    return torch.stack([torch.cos(a) * phase, -1j * torch.sin(a) * phase.conj()], dim=-1)
+
+
+def star_qubits(node_features, edge_features, centers, nbr_idx, edge_idx, mask, cdtype=COMPLEX):
+    # Every node and edge is encoded once per hop and gathered into the stars;
+    # padded slots hold |0>, which their masked gates leave untouched
+    node_q = encoded_qubits(node_features, cdtype)
+    edge_q = encoded_qubits(edge_features, cdtype)
+    ket0 = torch.tensor([1, 0], dtype=cdtype, device=node_q.device)
+    valid = mask.unsqueeze(-1)
+    star_edges = torch.where(valid, edge_q[edge_idx], ket0)
+    star_nodes = torch.cat([node_q[centers].unsqueeze(1), torch.where(valid, node_q[nbr_idx], ket0)], dim=1)
+    return star_edges, star_nodes
+
+
+def star_amplitudes(edge_q, node_q, cdtype=COMPLEX):
+    # (B, n_wires, 2) single-qubit factors of the encoded star, ancillas in |0>
+    batch, num_slots = edge_q.shape[:2]
+    amps = torch.zeros(batch, 2 * num_slots + 3, 2, dtype=cdtype, device=edge_q.device)
+    amps[:, :, 0] = 1
+    edge_wires, node_wires = encoding_wires(num_slots)
+    amps[:, edge_wires] = edge_q
+    amps[:, node_wires] = node_q
+    return amps
+
+
+def encoded_state(edge_q, node_q, cdtype=COMPLEX):
+    # (B, 2, ..., 2) product state assembled from the encoded qubits
+    amps = star_amplitudes(edge_q, node_q, cdtype)
+    batch, n_wires = amps.shape[:2]
+    state = amps[:, 0]
+    for wire in range(1, n_wires):
+        state = (state.unsqueeze(-1) * amps[:, wire].unsqueeze(1)).reshape(batch, -1)
+    return state.reshape(batch, *([2] * n_wires))
+
+
+def statevector_probs(ops, edge_q, node_q, mask, cdtype=COMPLEX, stats=None):
+    """Probabilities of (center, anc1, anc2) for a padded batch of stars.
+
+    edge_q: (B, K, 2) and node_q: (B, K+1, 2) encoded qubits, mask: (B, K) occupied slots.
+    """
+    num_slots = mask.shape[1]
+    state = encoded_state(edge_q, node_q, cdtype)
+    for op in ops:
+        matrix = op.matrix if op.slot is None else masked_matrix(op.matrix, mask[:, op.slot])
+        state = apply_matrix(state, matrix, op.wires)
+    return marginal_probs(state, star_wires(num_slots))
+
+
+def wire_outer(left, right, wires, weight=None):
+    # (d, d) sum over stars and untouched wires of left[.., i, ..] * conj(right[.., j, ..]) on ``wires``
+    k = len(wires)
+    axes = [w + 1 for w in wires]
+    front = list(range(1, k + 1))
+    left = torch.movedim(left, axes, front).reshape(left.shape[0], 2 ** k, -1)
+    right = torch.movedim(right, axes, front).reshape(right.shape[0], 2 ** k, -1)
+    if weight is not None:
+        left = left * weight.view(-1, 1, 1).to(left.dtype)
+    return torch.einsum('bir,bjr->ij', left, right.conj())
+
+
+class AdjointStatevector(torch.autograd.Function):
+    """Statevector simulation differentiated with the adjoint method.
+
+    Backward un-computes the state gate by gate instead of keeping every
+    intermediate state in the graph, so memory stays at two states per star.
+    Gradients of the shared gate matrices are reduced over all stars at once.
+    """
+
+    @staticmethod
+    def forward(ctx, state, mask, layout, readout, *matrices):
+        for (wires, slot), matrix in zip(layout, matrices):
+            state = apply_matrix(state, matrix if slot is None else masked_matrix(matrix, mask[:, slot]), wires)
+        ctx.save_for_backward(state, mask, *matrices)
+        ctx.layout, ctx.readout = layout, readout
+        return marginal_probs(state, readout)
+
+    @staticmethod
+    def backward(ctx, grad_probs):
+        state, mask, *matrices = ctx.saved_tensors
+        batch, n_wires = state.shape[0], state.dim() - 1
+        # d probs / d state: readout wires are in ascending order, so the (B, 8) gradient broadcasts
+        shape = [2 if w in ctx.readout else 1 for w in range(n_wires)]
+        adjoint = 2 * state * grad_probs.reshape(batch, *shape).to(state.dtype)
+
+        grads = [None] * len(matrices)
+        for k in reversed(range(len(matrices))):
+            wires, slot = ctx.layout[k]
+            occupied = None if slot is None else mask[:, slot]
+            inverse = matrices[k].mH if slot is None else masked_matrix(matrices[k].mH, occupied)
+            state = apply_matrix(state, inverse, wires)
+            if ctx.needs_input_grad[4 + k]:
+                grads[k] = wire_outer(adjoint, state, wires, occupied)
+            adjoint = apply_matrix(adjoint, inverse, wires)
+        return (adjoint, None, None, None, *grads)
+
+
+def adjoint_probs(ops, edge_q, node_q, mask, cdtype=COMPLEX, stats=None):
+    """``statevector_probs`` with adjoint-method gradients."""
+    num_slots = mask.shape[1]
+    state = encoded_state(edge_q, node_q, cdtype)
+    layout = [(op.wires, op.slot) for op in ops]
+    return AdjointStatevector.apply(state, mask, layout, star_wires(num_slots), *[op.matrix for op in ops])
+
+
+def pauli_matrices(cdtype=COMPLEX, device=None):
+    # (4, 2, 2) I, X, Y, Z
+    return torch.tensor([[[1, 0], [0, 1]],
+                         [[0, 1], [1, 0]],
+                         [[0, -1j], [1j, 0]],
+                         [[1, 0], [0, -1]]], dtype=cdtype, device=device)
+
+
+def depolarize(state, wire, p, generator=None):
+    # Each row gets a uniformly random X, Y or Z on ``wire`` with probability p (per row)
+    rows = state.shape[0]
+    with torch.no_grad():
+        hit = torch.rand(rows, generator=generator, device=state.device) < p
+        which = torch.randint(1, 4, (rows,), generator=generator, device=state.device)
+    paulis = pauli_matrices(state.dtype, state.device)
+    return apply_matrix(state, paulis[torch.where(hit, which, 0)], [wire])
+
+
+def amplitude_damp(state, wire, gamma, generator=None, eps=1e-12):
+    # Quantum-jump unraveling of amplitude damping with per-row rate ``gamma``
+    rows = state.shape[0]
+    excited = state.select(wire + 1, 1).reshape(rows, -1)
+    p_jump = gamma * (excited.real ** 2 + excited.imag ** 2).sum(1)
+    with torch.no_grad():
+        jump = torch.rand(rows, generator=generator, device=state.device) < p_jump
+    zero, one = torch.zeros_like(gamma), torch.ones_like(gamma)
+    stay = torch.stack([one, zero, zero, torch.sqrt(1 - gamma)], dim=-1) / (1 - p_jump).clamp_min(eps).sqrt().unsqueeze(-1)
+    decay = torch.stack([zero, torch.sqrt(gamma), zero, zero], dim=-1) / p_jump.clamp_min(eps).sqrt().unsqueeze(-1)
+    kraus = torch.where(jump.unsqueeze(-1), decay, stay).reshape(rows, 2, 2).to(state.dtype)
+    return apply_matrix(state, kraus, [wire])
+
+
+def trajectory_probs(ops, edge_q, node_q, mask, cdtype=COMPLEX, stats=None, trajectories=16,
+                     depolarizing=0.0, damping=0.0):
+    """Noisy (center, anc1, anc2) probabilities averaged over stochastic trajectories.
+
+    All trajectories of all stars evolve as one (trajectories * B) statevector batch.
+    Every ``Channel`` applies depolarizing and amplitude-damping noise to its wires
+    of occupied slots. The standard error of the averaged expectations is reported
+    as ``stats['noise_stderr']``.
+    """
+    batch, num_slots = mask.shape
+    generator = stats.get('generator') if stats is not None else None
+    state = encoded_state(edge_q, node_q, cdtype)
+    state = state.repeat(trajectories, *([1] * (state.dim() - 1)))
+    mask = mask.repeat(trajectories, 1)
+    rdtype = real_dtype(cdtype)
+    for op in ops:
+        if isinstance(op, Channel):
+            occupied = torch.ones(mask.shape[0], dtype=rdtype, device=mask.device)
+            if op.slot is not None:
+                occupied = mask[:, op.slot].to(rdtype)
+            for wire in op.wires:
+                if depolarizing:
+                    state = depolarize(state, wire, depolarizing * occupied, generator)
+                if damping:
+                    state = amplitude_damp(state, wire, damping * occupied, generator)
+            continue
+        matrix = op.matrix if op.slot is None else masked_matrix(op.matrix, mask[:, op.slot])
+        state = apply_matrix(state, matrix, op.wires)
+
+    probs = marginal_probs(state, star_wires(num_slots)).reshape(trajectories, batch, -1)
+    if stats is not None and trajectories > 1:
+        expvals = probs.detach() @ z_signs(3, probs.dtype, probs.device)
+        stderr = float((expvals.std(0) / math.sqrt(trajectories)).max())
+        update_stat(stats, 'noise_stderr', max, stderr)
+    return probs.mean(0)
+
+
+def split_star_ops(ops, num_slots):
+    """Group compiled ops by star stage and remap them to local wires.
+
+    Returns per-slot message ops on (edge_i, neighbor_i) -> (0, 1) and the ordered
+    update ops on (center, anc1, anc2, neighbor_i) -> (0, 1, 2, 3). Raises if the
+    program does not have the star structure the reduced-density-matrix engine needs.
+    """
+    center, anc1, anc2 = star_wires(num_slots)
+    messages = [[] for _ in range(num_slots)]
+    updates = []
+    folded = set()
+    for op in ops:
+        slot = op.slot
+        if slot is None:
+            raise ValueError("Reduced-density-matrix engine needs every gate assigned to a neighbor slot")
+        pair = {slot: 0, center + slot + 1: 1}
+        fold = {center: 0, anc1: 1, anc2: 2, center + slot + 1: 3}
+        in_pair = all(w in pair for w in op.wires)
+        in_fold = all(w in fold for w in op.wires)
+        if in_pair and slot not in folded:
+            messages[slot].append(Op(tuple(pair[w] for w in op.wires), op.matrix, slot))
+        elif in_fold:
+            if updates and updates[-1][0] != slot and slot in folded:
+                raise ValueError(f"Update gates of slot {slot} are not contiguous")
+            folded.add(slot)
+            if not updates or updates[-1][0] != slot:
+                updates.append((slot, []))
+            updates[-1][1].append(Op(tuple(fold[w] for w in op.wires), op.matrix, slot))
+        else:
+            raise ValueError(f"Gate on wires {op.wires} breaks the star structure of slot {slot}")
+    return messages, updates
+
+
+def rdm_probs(ops, edge_q, node_q, mask, cdtype=COMPLEX, stats=None):
+    """Exact (center, anc1, anc2) probabilities with cost linear in the number of slots.
+
+    Each (edge_i, neighbor_i) pair is simulated as a 2-qubit state, the edge is traced
+    out, and the neighbor is folded into the 3-qubit (center, anc1, anc2) density
+    matrix by its update gates and traced out right after.
+    """
+    batch, num_slots = mask.shape
+    messages, updates = split_star_ops(ops, num_slots)
+
+    neighbor_rdms = {}
+    for slot, _ in updates:
+        pair = (edge_q[:, slot, :, None] * node_q[:, slot + 1, None, :]).reshape(batch, 2, 2)
+        for op in messages[slot]:
+            pair = apply_matrix(pair, masked_matrix(op.matrix, mask[:, slot]), op.wires)
+        neighbor_rdms[slot] = torch.einsum('ben,bem->bnm', pair, pair.conj())
+
+    vec = torch.zeros(batch, 2, 4, dtype=cdtype, device=edge_q.device)
+    vec[:, :, 0] = node_q[:, 0]
+    vec = vec.reshape(batch, 8)
+    rho = torch.einsum('bi,bj->bij', vec, vec.conj()).reshape(batch, *([2] * 6))
+
+    for slot, slot_ops in updates:
+        joint = torch.einsum('bijkpqr,bst->bijkspqrt', rho, neighbor_rdms[slot])
+        for op in slot_ops:
+            matrix = masked_matrix(op.matrix, mask[:, slot])
+            joint = apply_matrix(joint, matrix, op.wires)
+            joint = apply_matrix(joint, matrix.conj(), [w + 4 for w in op.wires])
+        rho = torch.einsum('bijkspqrs->bijkpqr', joint)
+
+    return torch.diagonal(rho.reshape(batch, 8, 8), dim1=-2, dim2=-1).real
+
+
+SHOT_POLICIES = ('uniform', 'degree', 'variance', 'equal_variance')
+
+
+def allocate_shots(shots, probs, mask, policy='uniform'):
+    """Per-star shot counts for a budget of ``shots`` per star.
+
+    'degree' spends shots in proportion to the star size, 'variance' in proportion
+    to the standard deviation of the star's PauliZ estimates (Neyman allocation),
+    which minimizes the summed variance. Both redistribute the uniform total of
+    ``shots`` per star. 'equal_variance' keeps the Neyman shares but sizes the
+    total so the summed variance equals that of the uniform allocation, which
+    takes at most the uniform total and fewer the more the stars' variances differ.
+    """
+    batch = probs.shape[0]
+    if policy == 'uniform':
+        return torch.full((batch,), shots, dtype=torch.long, device=probs.device)
+    with torch.no_grad():
+        if policy == 'degree':
+            weight = mask.sum(1).to(probs.dtype) + 1
+        elif policy in ('variance', 'equal_variance'):
+            expvals = probs @ z_signs(3, probs.dtype, probs.device)
+            weight = (1 - expvals ** 2).clamp_min(0).sum(1).sqrt()
+        else:
+            raise ValueError(f"Unsupported shot policy: {policy}")
+        tiny = torch.finfo(weight.dtype).tiny
+        share = weight / weight.sum().clamp_min(tiny)
+        if policy == 'equal_variance':
+            # Uniform: sum(w^2) / shots; Neyman with N shots: sum(w)^2 / N
+            total = shots * weight.sum() ** 2 / (weight ** 2).sum().clamp_min(tiny)
+            return torch.ceil(total * share).long().clamp_min(1)
+        return torch.round(shots * batch * share).long().clamp_min(1)
+
+
+def sample_probs(probs, shots, generator=None):
+    """Empirical distributions from ``shots[b]`` samples of every row of ``probs``, in one multinomial call.
+
+    The sampled frequencies are returned in the forward pass with the gradient of
+    the exact probabilities (straight-through estimator).
+    """
+    batch, dim = probs.shape
+    max_shots = int(shots.max())
+    with torch.no_grad():
+        samples = torch.multinomial(probs.clamp_min(0), max_shots, replacement=True, generator=generator)
+        used = (torch.arange(max_shots, device=probs.device) < shots.unsqueeze(1)).to(probs.dtype)
+        counts = torch.zeros_like(probs).scatter_add_(1, samples, used)
+        freqs = counts / shots.unsqueeze(1).to(probs.dtype)
+    return probs + (freqs - probs).detach()
+
+
+# Differentiation methods per engine: 'backprop' through torch autograd or an
+# engine-specific custom backward
+DIFF_METHODS = {
+    'statevector': {'backprop': statevector_probs, 'adjoint': adjoint_probs,
+                    'parameter-shift': None},  # paramshift.shift_probs, imported on demand
+}
+
+ENGINES = {
+    'statevector': statevector_probs,
+    'rdm': rdm_probs,
+    'mps': None,  # mps.mps_probs, imported on demand
+    'pauli': None,  # pauli.pauli_probs, imported on demand
+}
+
+
+def get_engine(backend, diff_method='backprop'):
+    # Every engine maps (ops, edge_q, node_q, mask, cdtype, stats, **options) to (B, 8) readout probabilities
+    if diff_method != 'backprop':
+        if diff_method not in DIFF_METHODS.get(backend, {}):
+            raise ValueError(f"diff_method={diff_method} is not supported by the {backend} backend")
+        if diff_method == 'parameter-shift':
+            from paramshift import shift_probs
+            return shift_probs
+        return DIFF_METHODS[backend][diff_method]
+    if backend == 'mps':
+        from mps import mps_probs
+        return mps_probs
+    if backend == 'pauli':
+        from pauli import pauli_probs
+        return pauli_probs
+    return ENGINES[backend]
+
+
+class JobStats:
+    """View of a forward's ``stats`` for one engine call (job).
+
+    The ``local`` entries (the call's generator and shot sampler) are its own;
+    everything else is read from and written to the shared ``stats``. Jobs run
+    on worker threads, so shared counters go through ``update_stat`` under ``lock``.
+    """
+
+    def __init__(self, shared, local, lock):
+        self.shared = shared
+        self.local = local
+        self.lock = lock
+
+    def get(self, key, default=None):
+        return self.local[key] if key in self.local else self.shared.get(key, default)
+
+    def __getitem__(self, key):
+        return self.local[key] if key in self.local else self.shared[key]
+
+    def __setitem__(self, key, value):
+        if key in self.local:
+            self.local[key] = value
+        else:
+            self.shared[key] = value
+
+
+def update_stat(stats, key, combine, value):
+    """``stats[key] = combine(stats.get(key, 0), value)``, atomic for the ``JobStats`` of concurrent jobs."""
+    with getattr(stats, 'lock', nullcontext()):
+        stats[key] = combine(stats.get(key, 0), value)
+
+
+class StarCircuitLayer(nn.Module):
+    """Batched torch replacement for ``TorchLayer(QNode(qgcn_enhance_layer))``.
+
+    Weights keep the TorchLayer names and shapes so checkpoints load into either
+    backend. ``forward`` takes graph-level features plus padded star indices and
+    returns the three PauliZ expectations for every star at once.
+    """
+
+    backends = tuple(ENGINES)
+
+    def __init__(self, weight_shapes, init_method=None, backend='statevector', chunk_size=None,
+                 max_bond=16, pauli_max_weight=None, pauli_min_coeff=0.0, pauli_max_terms=2 ** 16, fusion=True,
+                 diff_method='backprop', precision='double', validate_precision=False,
+                 shots=None, shot_policy='uniform', seed=None, depolarizing=0.0, damping=0.0,
+                 trajectories=16, job_batcher=None, surrogate_order=None):
+        super().__init__()
+        if backend not in self.backends:
+            raise ValueError(f"Unsupported simulation backend: {backend}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}")
+        if shot_policy not in SHOT_POLICIES:
+            raise ValueError(f"Unsupported shot policy: {shot_policy}")
+        self.backend = backend
+        self.precision = precision
+        self.cdtype = PRECISIONS[precision]
+        self.validate_precision = validate_precision
+        # Finite-shot readout: None = exact expectations
+        self.shots = shots
+        self.shot_policy = shot_policy
+        # Seeds shot sampling and noise trajectories
+        self.seed = seed
+        self._generator = None
+        self.diff_method = diff_method
+        self.engine = get_engine(backend, diff_method)
+        # Parameter shift runs the symbolic gates on RX/RZ angles instead of compiled ops on encoded qubits
+        self.parameter_shift = diff_method == 'parameter-shift'
+        # Zero noise keeps the noiseless engines
+        self.noisy = depolarizing > 0 or damping > 0
+        if self.noisy:
+            if backend != 'statevector' or diff_method != 'backprop':
+                raise ValueError("Noisy trajectories need backend='statevector' with diff_method='backprop'")
+            self.engine = trajectory_probs
+        # Fourier surrogate for inference, truncated to ``surrogate_order`` (None = circuit simulation)
+        self.surrogate_order = surrogate_order
+        if surrogate_order is not None and (self.noisy or self.parameter_shift):
+            raise ValueError("The Fourier surrogate needs a noiseless circuit with compiled ops")
+        self._surrogates = {}
+        self._surrogate_key = None
+        self.chunk_size = chunk_size
+        # jobs.JobBatcher: star circuits are submitted as jobs instead of simulated in place
+        self.job_batcher = job_batcher
+        self.fusion_width = FUSION_WIDTHS[backend] if fusion else None
+        self.engine_options = {}
+        if backend == 'mps':
+            self.engine_options = {'max_bond': max_bond}
+        elif backend == 'pauli':
+            self.engine_options = {'max_weight': pauli_max_weight, 'min_coeff': pauli_min_coeff,
+                                   'max_terms': pauli_max_terms}
+        if self.noisy:
+            self.engine_options = {'trajectories': trajectories, 'depolarizing': depolarizing, 'damping': damping}
+        if self.parameter_shift:
+            self.engine_options = {'max_rows': chunk_size}
+        self.weight_shapes = dict(weight_shapes)
+        for name, shape in self.weight_shapes.items():
+            weight = torch.empty(shape)
+            weight = init_method(weight) if init_method is not None else nn.init.uniform_(weight, b=2 * math.pi)
+            self.register_parameter(name, nn.Parameter(weight))
+        num_qbit = self.weight_shapes['spreadlayer'][1]
+        self.num_slots = (num_qbit + 1) // 2 - 1
+        # Max over stars of the last forward (MPS truncation only)
+        self.truncation_error = 0.0
+        # Max deviation of the last forward from a complex128 run (validate_precision only)
+        self.precision_error = 0.0
+        # Shots spent by the last forward, and how many fewer than ``shots`` per star (finite-shot readout only)
+        self.total_shots = 0
+        self.shots_saved = 0
+        # Max standard error over stars of the last forward (noisy trajectories only)
+        self.noise_stderr = 0.0
+        # Largest propagated observable of the last forward (Pauli backend only)
+        self.pauli_terms = 0
+        # Statistics of the last forward with grad enabled, updated by its backward
+        self._train_stats = {}
+        # Worst-case error of the Fourier surrogate over the fitted star sizes
+        self.surrogate_bound = 0.0
+        # (gates, ops) of the last compiled program
+        self.gate_counts = (0, 0)
+        # Gate structure and fusion plan, traced once; only weights change between calls
+        self._structure = None
+        # Weight-only ops of no-grad forwards, rebuilt when a weight changes in place
+        # (optimizer step, load_state_dict)
+        self._cache_key = None
+        self._cached_ops = None
+        self._engine_cache = {}
+
+    def extra_repr(self):
+        options = ''.join(f", {k}={v}" for k, v in self.engine_options.items())
+        if self.shots:
+            options += f", shots={self.shots}, shot_policy={self.shot_policy}"
+        return (f"backend={self.backend}, diff_method={self.diff_method}, precision={self.precision}, "
+                f"num_slots={self.num_slots}, fusion_width={self.fusion_width}{options}")
+
+    traced_weights = ('strong', 'inits', 'update')
+
+    def structure(self):
+        """(gates, fusion plan) of the star program, with integer ids into ``weight_values()`` as parameters.
+
+        The program is traced once on placeholder weights holding their own flat
+        index; every later call only rebinds the numeric values.
+        """
+        if self._structure is None:
+            with record_function('qgnn.trace'):
+                ids, offset = {}, 0
+                for name in self.traced_weights:
+                    shape = getattr(self, name).shape
+                    ids[name] = torch.arange(offset, offset + math.prod(shape), dtype=torch.float64).reshape(shape)
+                    offset += math.prod(shape)
+                gates = star_program(ids['strong'], ids['inits'], ids['update'], self.num_slots, noise=self.noisy)
+                gates = [gate._replace(params=tuple(int(p) for p in gate.params)) for gate in gates]
+                plan = fusion_plan(gates, self.fusion_width) if self.fusion_width is not None else None
+                self._structure = (gates, plan)
+        return self._structure
+
+    def weight_values(self):
+        return torch.cat([getattr(self, name).reshape(-1) for name in self.traced_weights])
+
+    def program(self):
+        # Symbolic gates bound to the current weights
+        gates, _ = self.structure()
+        values = self.weight_values()
+        return [gate._replace(params=tuple(values[i] for i in gate.params)) for gate in gates]
+
+    def compile_ops(self, device=None, cdtype=None):
+        cdtype = cdtype or self.cdtype
+        gates, plan = self.structure()
+        with record_function('qgnn.bind'):
+            matrices = gate_matrices(gates, self.weight_values(), cdtype, device)
+            if plan is None:
+                ops = [Channel(gate.wires, gate.slot) if gate.name == NOISE else Op(gate.wires, matrix, gate.slot)
+                       for gate, matrix in zip(gates, matrices) if gate.name != BARRIER]
+            else:
+                ops = fused_ops(plan, gates, matrices)
+        self.gate_counts = (sum(gate.name not in (BARRIER, NOISE) for gate in gates),
+                            sum(isinstance(op, Op) for op in ops))
+        return ops
+
+    def circuits_per_step(self, key='circuits'):
+        # Circuits run by the last training forward and its backward (parameter-shift only);
+        # 'shared_circuits' counts those that shift a weight shared across slots once more
+        return self._train_stats.get(key, 0)
+
+    def cached_ops(self, device=None):
+        # With grad enabled every forward compiles its own ops: a shared graph would be
+        # freed by the first backward (or torch.autograd.grad) that runs through it
+        if torch.is_grad_enabled():
+            return self.compile_ops(device)
+        key = (tuple(param._version for param in self.parameters()), device)
+        if key != self._cache_key:
+            self._cached_ops = self.compile_ops(device)
+            self._engine_cache = {}
+            self._cache_key = key
+        return self._cached_ops
+
+    def star_angles(self, node_features, edge_features, centers, nbr_idx, edge_idx, mask, cdtype=COMPLEX):
+        # Padded slots get zero angles, i.e. |0> like in ``star_qubits``
+        rdtype = real_dtype(cdtype)
+        valid = mask.unsqueeze(-1).to(rdtype)
+        edge_x = edge_features[edge_idx].to(rdtype) * valid
+        node_x = torch.cat([node_features[centers].unsqueeze(1).to(rdtype),
+                            node_features[nbr_idx].to(rdtype) * valid], dim=1)
+        return edge_x, node_x
+
+    def star_inputs(self, *stars, cdtype=COMPLEX):
+        if self.parameter_shift:
+            return self.star_angles(*stars, cdtype=cdtype)
+        return star_qubits(*stars, cdtype=cdtype)
+
+    def simulate(self, ops, edge_q, node_q, mask, cdtype=COMPLEX, cache=None):
+        # Stars are routed by neighbor count to a register with just the wires they use
+        counts = mask.sum(1)
+        chunk = self.job_batcher.job_size if self.job_batcher is not None else self.chunk_size or mask.shape[0]
+        # Per-forward statistics; ``cache`` lives as long as ``ops`` (e.g. propagated Pauli observables)
+        generator = self.generator(edge_q.device)
+        stats = {'cache': {} if cache is None else cache, 'generator': generator}
+        widths = stats['cache'].setdefault('narrow_ops', {})
+        order, calls = [], []
+        for n in counts.unique().tolist():
+            if n not in widths:
+                widths[n] = narrow_ops(ops, self.num_slots, n)
+            idx = (counts == n).nonzero(as_tuple=True)[0]
+            for s in range(0, idx.shape[0], chunk):
+                rows = idx[s:s + chunk]
+                args = (widths[n], edge_q[rows, :n], node_q[rows, :n + 1], mask[rows, :n], cdtype)
+                calls.append((args, len(rows)))
+                order.append(rows)
+        # Jobs run concurrently, so each draws from its own generator, seeded from the
+        # layer's (advanced once per forward) and the job index
+        base = None
+        if self.job_batcher is not None and generator is not None:
+            base = int(torch.randint(2 ** 62, (1,), generator=generator, device=generator.device))
+        kwargs = dict(stats=stats, **self.engine_options)
+        lock = threading.Lock()
+        runs = []
+        for i, ((args, size), rows) in enumerate(zip(calls, order)):
+            local = {}
+            if base is not None:
+                local['generator'] = torch.Generator(device=generator.device).manual_seed(base + i)
+            if self.parameter_shift and self.shots:
+                local['sampler'] = self.shot_sampler(stats, rows, local.get('generator', generator))
+            if local or self.job_batcher is not None:
+                runs.append((args, dict(kwargs, stats=JobStats(stats, local, lock)), size))
+            else:
+                runs.append((args, kwargs, size))
+        if self.job_batcher is None:
+            probs = [self.engine(*args, **call_kwargs) for args, call_kwargs, _ in runs]
+        else:
+            probs = self.job_batcher.run([self.job_batcher.job(self.engine, args, call_kwargs, size)
+                                          for args, call_kwargs, size in runs])
+        return torch.cat(probs, dim=0)[torch.argsort(torch.cat(order))], stats
+
+    def shot_sampler(self, stats, rows, generator):
+        # Shifted circuits of the stars ``rows`` get the shots the forward pass allocated to them
+        # (``stats['shots']``, set by ``forward`` before any backward runs)
+        def sample(probs):
+            shots = stats['shots'][rows]
+            return sample_probs(probs, shots.repeat(probs.shape[0] // shots.shape[0]), generator)
+        return sample
+
+    def generator(self, device):
+        # Seeded once and then advanced by every forward
+        if self.seed is None:
+            return None
+        if self._generator is None or self._generator.device != torch.device(device):
+            self._generator = torch.Generator(device=device)
+            self._generator.manual_seed(self.seed)
+        return self._generator
+
+    @torch.no_grad()
+    def precision_deviation(self, expvals, *stars, replay=None):
+        # stars: (node_features, edge_features, centers, nbr_idx, edge_idx, mask). ``replay`` is the
+        # generator state the forward simulated from: the reference reuses its noise draws, and the
+        # generator is left where the forward left it
+        generator = self.generator(stars[0].device)
+        current = generator.get_state() if generator is not None else None
+        if replay is not None:
+            generator.set_state(replay)
+        try:
+            edge_q, node_q = self.star_inputs(*stars, cdtype=torch.complex128)
+            ops = self.program() if self.parameter_shift else self.compile_ops(edge_q.device, torch.complex128)
+            probs, _ = self.simulate(ops, edge_q, node_q, stars[-1], torch.complex128)
+        finally:
+            if current is not None:
+                generator.set_state(current)
+        reference = probs @ z_signs(3, probs.dtype, probs.device)
+        return float((expvals.double() - reference).abs().max())
+
+    @torch.no_grad()
+    def surrogate(self, num_slots, device=None):
+        """Fourier surrogate for stars with ``num_slots`` neighbors, refitted when the weights change."""
+        from surrogate import fit_surrogate
+        key = (tuple(param._version for param in self.parameters()), device)
+        if key != self._surrogate_key:
+            self._surrogates = {}
+            self._surrogate_key = key
+            self._surrogate_ops = self.compile_ops(device, torch.complex128)
+        if num_slots not in self._surrogates:
+            ops = narrow_ops(self._surrogate_ops, self.num_slots, num_slots)
+            self._surrogates[num_slots] = fit_surrogate(ops, num_slots, self.surrogate_order)
+        self.surrogate_bound = max(float(bound.max()) for _, _, bound in self._surrogates.values())
+        return self._surrogates[num_slots]
+
+    def surrogate_forward(self, *stars):
+        from surrogate import surrogate_expvals
+        mask = stars[-1]
+        edge_q, node_q = star_qubits(*stars, cdtype=self.cdtype)
+        counts = mask.sum(1)
+        expvals = torch.zeros(mask.shape[0], 3, dtype=real_dtype(self.cdtype), device=mask.device)
+        for n in counts.unique().tolist():
+            idx = (counts == n).nonzero(as_tuple=True)[0]
+            codes, coeffs, _ = self.surrogate(n, edge_q.device)
+            expvals[idx] = surrogate_expvals(codes, coeffs, edge_q[idx, :n], node_q[idx, :n + 1])
+        return expvals
+
+    def forward(self, node_features, edge_features, centers, nbr_idx, edge_idx, mask):
+        stars = (node_features, edge_features, centers, nbr_idx, edge_idx, mask)
+        if self.surrogate_order is not None and not self.training:
+            return self.surrogate_forward(*stars).to(node_features.dtype)
+        edge_q, node_q = self.star_inputs(*stars, cdtype=self.cdtype)
+        generator = self.generator(edge_q.device)
+        replay = generator.get_state() if self.validate_precision and generator is not None else None
+        if self.parameter_shift:
+            probs, stats = self.simulate(self.program(), edge_q, node_q, mask, self.cdtype)
+        else:
+            cache = None if torch.is_grad_enabled() else self._engine_cache
+            ops = self.cached_ops(node_features.device)
+            probs, stats = self.simulate(ops, edge_q, node_q, mask, self.cdtype, cache)
+        if torch.is_grad_enabled():
+            self._train_stats = stats
+        self.truncation_error = stats.get('truncation_error', 0.0)
+        self.noise_stderr = stats.get('noise_stderr', 0.0)
+        self.pauli_terms = stats.get('pauli_terms', 0)
+        expvals = probs @ z_signs(3, probs.dtype, probs.device)
+        if self.validate_precision:
+            self.precision_error = self.precision_deviation(expvals, *stars, replay=replay)
+        if self.shots:
+            shots = allocate_shots(self.shots, probs, mask, self.shot_policy)
+            stats['shots'] = shots
+            self.total_shots = int(shots.sum())
+            # Per-star rounding can allocate a few shots more than uniform (``degree`` policy)
+            self.shots_saved = max(self.shots * mask.shape[0] - self.total_shots, 0)
+            probs = sample_probs(probs, shots, self.generator(probs.device))
+            expvals = probs @ z_signs(3, probs.dtype, probs.device)
+        return expvals.to(node_features.dtype)
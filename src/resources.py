@@ -0,0 +1,193 @@
+import os
+
+import torch
+
+from qsim import PRECISIONS, FUSION_WIDTHS, BARRIER, NOISE, Op, StarCircuitLayer, narrow_ops, fuse_program, \
+    compile_program
+
+
+# Resource estimates for the QGNN quantum layers, made before the model is built
+# from the degree distribution of the loaded dataset. Every center is one star
+# circuit per hop with n = min(in-degree, graphlet_size - 1) occupied slots,
+# simulated on 2n + 3 wires. Memory figures model what each engine keeps alive
+# for the backward pass; they are meant to catch infeasible settings by orders
+# of magnitude, not to predict the allocator to the byte.
+
+# (backend, diff_method) pairs tried by --backend auto; mps is exact at --max_bond >= 16
+AUTO_CANDIDATES = (('statevector', 'backprop'), ('statevector', 'adjoint'), ('rdm', 'backprop'),
+                   ('mps', 'backprop'))
+EXACT_BACKENDS = ('pennylane', 'statevector', 'rdm')
+
+
+def star_histogram(graphs, num_slots):
+    # (num_graphs, num_slots + 1): stars with n occupied slots in every graph
+    rows = []
+    for graph in graphs:
+        degree = torch.bincount(graph.edge_index[1].cpu(), minlength=graph.num_nodes)
+        degree = degree[degree > 0].clamp(max=num_slots)
+        rows.append(torch.bincount(degree, minlength=num_slots + 1))
+    if not rows:
+        return torch.zeros(0, num_slots + 1, dtype=torch.long)
+    return torch.stack(rows)
+
+
+def bucket_programs(w_shapes, backend, fusion=True):
+    """Per occupied-slot count n: (gates, ops, shift terms) of one star circuit."""
+    from paramshift import shift_rule
+    with torch.no_grad():
+        layer = StarCircuitLayer(w_shapes)
+        gates = layer.program()
+        programs = []
+        for n in range(layer.num_slots + 1):
+            narrow = narrow_ops(gates, layer.num_slots, n)
+            if backend != 'pennylane' and fusion:
+                ops = fuse_program(narrow, FUSION_WIDTHS[backend])
+            else:
+                ops = compile_program(narrow)
+            narrow = [gate for gate in narrow if gate.name not in (BARRIER, NOISE)]
+            # Weight shifts plus two shifts per RX/RZ angle of the 2n + 1 encoded wires
+            shifts = sum(len(shift_rule(gate.name)) * len(gate.params) for gate in narrow) + 4 * (2 * n + 1)
+            programs.append((len(narrow), sum(isinstance(op, Op) for op in ops), shifts))
+    return layer.num_slots, programs
+
+
+def star_memory(backend, diff_method, wires, ops, itemsize, max_bond=16):
+    # Bytes a training forward keeps alive per star (parameter-shift: per simulated row)
+    state = 2 ** wires * itemsize
+    if backend in ('statevector', 'pennylane'):
+        if diff_method == 'backprop':
+            return (ops + 1) * state
+        if diff_method == 'adjoint':
+            return 3 * state
+        return 2 * state
+    if backend == 'rdm':
+        # 4-qubit density matrix (update ops act on it twice) and the slot's 2-qubit pair
+        return (2 * ops + 1) * 4 ** 4 * itemsize + 16 * itemsize
+    if backend == 'mps':
+        # Every routed two-qubit split keeps its SVD factors; bonds never exceed 16 (mps.chain_order)
+        return ops * wires * 3 * (2 * min(max_bond, 16)) ** 2 * itemsize
+    return None
+
+
+def star_cost(backend, diff_method, wires, ops, max_bond=16):
+    # Multiply-adds per star for a forward and backward pass
+    if backend in ('statevector', 'pennylane'):
+        width = 2 if backend == 'pennylane' else FUSION_WIDTHS[backend]
+        forward = ops * 2 ** wires * 2 ** width
+        return forward * (4 if diff_method == 'adjoint' else 3)
+    if backend == 'rdm':
+        return 3 * ops * 2 * 4 ** 4 * 2 ** FUSION_WIDTHS[backend]
+    if backend == 'mps':
+        return 3 * ops * wires * (2 * min(max_bond, 16)) ** 3
+    return None
+
+
+def estimate_resources(w_shapes, train_graphs, eval_graphs, batch_size, hops, backend='statevector',
+                       diff_method='backprop', precision='double', fusion=True, max_bond=16, chunk_size=None,
+                       trajectories=1, checkpoint_hops=False):
+    """Resource estimate of one training run of the quantum layers.
+
+    ``train_graphs`` are split into batches of ``batch_size`` like the (unshuffled)
+    training loader; ``eval_graphs`` are all graphs evaluated once per epoch. With
+    ``checkpoint_hops`` only one hop keeps its quantum states at a time.
+    """
+    num_slots, programs = bucket_programs(w_shapes, backend, fusion)
+    cdtype = PRECISIONS['double' if backend == 'pennylane' else precision]
+    itemsize = torch.empty(0, dtype=cdtype).element_size()
+    train = star_histogram(train_graphs, num_slots)
+    evals = star_histogram(eval_graphs, num_slots).sum(0)
+    present = [n for n in range(num_slots + 1) if train[:, n].sum() + evals[n] > 0] or [num_slots]
+    widest = max(present)
+
+    peak = 0
+    unknown = False
+    for s in range(0, train.shape[0], batch_size):
+        stars = train[s:s + batch_size].sum(0).tolist()
+        batch = 0
+        for n in present:
+            gates, ops, shifts = programs[n]
+            memory = star_memory(backend, diff_method, 2 * n + 3, ops, itemsize, max_bond)
+            if memory is None:
+                unknown = True
+                continue
+            rows = stars[n]
+            if diff_method == 'parameter-shift':
+                rows = min(rows * shifts, chunk_size or rows * shifts)
+            batch += rows * memory * trajectories
+        peak = max(peak, batch)
+
+    total = train.sum(0)
+    circuits = hops * int(total.sum() + evals.sum())
+    cost = 0
+    for n in present:
+        gates, ops, shifts = programs[n]
+        if diff_method == 'parameter-shift':
+            circuits += hops * int(total[n]) * shifts
+        per_star = star_cost(backend, diff_method, 2 * n + 3, ops, max_bond)
+        if per_star is None or cost is None:
+            cost = None
+            continue
+        runs = (1 + shifts) if diff_method == 'parameter-shift' else 1
+        cost += hops * int(total[n]) * per_star * runs * trajectories
+
+    gates, ops, _ = programs[widest]
+    if not unknown:
+        peak *= 1 if checkpoint_hops else hops
+    return {'backend': backend, 'diff_method': diff_method, 'wires': 2 * widest + 3, 'gates': gates, 'ops': ops,
+            'state_bytes': 2 ** (2 * widest + 3) * itemsize, 'peak_bytes': None if unknown else peak,
+            'circuits_per_epoch': circuits, 'cost': cost, 'exact': backend in EXACT_BACKENDS or (backend == 'mps' and max_bond >= 16)}
+
+
+def available_memory(device):
+    # Free bytes on ``device`` (host RAM for the CPU), None if the host does not report it
+    device = torch.device(device)
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    try:
+        # Not available on macOS (ValueError) or Windows (AttributeError)
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, AttributeError, OSError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available
+
+
+def select_backend(estimates, budget):
+    """Cheapest estimate whose peak memory fits ``budget``; exact backends win over approximate ones.
+
+    Estimates without a known peak memory or cost are not considered; a None
+    ``budget`` (free memory unknown) fits every estimate. Raises ValueError when
+    none is left or nothing fits.
+    """
+    known = [e for e in estimates if e['peak_bytes'] is not None and e['cost'] is not None]
+    if not known:
+        names = ', '.join(f"{e['backend']} ({e['diff_method']})" for e in estimates) or 'none'
+        raise ValueError(f"No simulation backend has a memory and cost estimate (candidates: {names}). "
+                         f"Pass --backend explicitly.")
+    feasible = [e for e in known if budget is None or e['peak_bytes'] <= budget]
+    if not feasible:
+        smallest = min(known, key=lambda e: e['peak_bytes'])
+        raise ValueError(f"No simulation backend fits in {format_bytes(budget)}: the smallest estimate is "
+                         f"{format_bytes(smallest['peak_bytes'])} ({smallest['backend']}, "
+                         f"{smallest['diff_method']}). Reduce graphlet_size, batch_size or num_ent_layers.")
+    exact = [e for e in feasible if e['exact']]
+    return min(exact or feasible, key=lambda e: e['cost'])
+
+
+def format_bytes(num):
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if num < 1024 or unit == 'TiB':
+            return f"{num:.1f} {unit}"
+        num /= 1024
+
+
+def format_estimate(estimate):
+    peak = 'unknown' if estimate['peak_bytes'] is None else format_bytes(estimate['peak_bytes'])
+    return (f"{estimate['backend']} ({estimate['diff_method']}): {estimate['wires']} wires, "
+            f"{estimate['gates']} gates -> {estimate['ops']} ops per star, "
+            f"{format_bytes(estimate['state_bytes'])} statevector per star, peak autograd memory {peak} per batch, "
+            f"{estimate['circuits_per_epoch']} circuits per epoch")
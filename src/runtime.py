@@ -0,0 +1,110 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+from qsim import COMPLEX, Op, narrow_ops, star_qubits, statevector_probs, z_signs
+from utils import adjacency_csr, build_csr, cover_stars, seeded_generator, star_order, sample_stars
+from export import FORMAT, VERSION
+
+
+# Torch-only inference runtime for artifacts written by export.py. It mirrors
+# the eval-mode forward of QGNNGraphClassifier / QGNNNodeClassifier: the same
+# star sampling, the compiled star circuit on the statevector engine, and the
+# classical layers from plain tensors. Nothing from PennyLane or PyG is imported.
+
+
+def load_artifact(path, device='cpu'):
+    artifact = torch.load(path, map_location=device, weights_only=True)
+    if artifact.get('format') != FORMAT or artifact.get('version', 0) > VERSION:
+        raise ValueError(f"{path} is not a QGNN artifact this runtime can read")
+    return artifact
+
+
+def apply_norm(x, norm):
+    if norm is None:
+        return x
+    if norm['type'] == 'batch_norm':
+        return F.batch_norm(x, norm['running_mean'], norm['running_var'], norm['weight'], norm['bias'],
+                            training=False, eps=norm['eps'])
+    return F.layer_norm(x, x.shape[-1:], norm['weight'], norm['bias'], norm['eps'])
+
+
+def apply_mlp(x, mlp):
+    for layer in mlp['layers']:
+        x = F.linear(x, layer['weight'], layer['bias'])
+        if layer['act'] and mlp['act_first']:
+            x = F.leaky_relu(x, mlp['negative_slope'])
+        x = apply_norm(x, layer['norm'])
+        if layer['act'] and not mlp['act_first']:
+            x = F.leaky_relu(x, mlp['negative_slope'])
+    return x
+
+
+class QGNNRuntime:
+    """Eval-mode QGNN classifier loaded from an exported artifact.
+
+    ``runtime(x, edge_attr, edge_index, batch)`` takes the same inputs as the
+    model (``batch`` is ignored for node classification) and returns logits.
+    ``seed`` fixes the star sampling (None: global RNG).
+    """
+
+    def __init__(self, path, device='cpu', seed=None):
+        self.device = torch.device(device)
+        self.artifact = load_artifact(path, self.device)
+        self.task = self.artifact['task']
+        self.config = self.artifact['config']
+        self.num_slots = self.config['graphlet_size'] - 1
+        self.star_planner = self.config.get('star_planner', 'sample')
+        self.generator = seeded_generator(None, seed, 'cpu' if self.star_planner == 'cover' else self.device)
+        self.programs = [[Op(tuple(op['wires']), op['matrix'], op['slot']) for op in hop['quantum']['program']]
+                         for hop in self.artifact['hops']]
+        # Ops per (hop, neighbor count), remapped to the narrow register once
+        self.narrow = {}
+
+    def quantum_messages(self, hop, node_features, edge_features, centers, nbr_idx, edge_idx, mask):
+        edge_q, node_q = star_qubits(node_features, edge_features, centers, nbr_idx, edge_idx, mask, COMPLEX)
+        counts = mask.sum(1)
+        expvals = torch.zeros(mask.shape[0], 3, dtype=torch.float64, device=mask.device)
+        signs = z_signs(3, torch.float64, mask.device)
+        for n in counts.unique().tolist():
+            if (hop, n) not in self.narrow:
+                self.narrow[hop, n] = narrow_ops(self.programs[hop], self.num_slots, n)
+            idx = (counts == n).nonzero(as_tuple=True)[0]
+            probs = statevector_probs(self.narrow[hop, n], edge_q[idx, :n], node_q[idx, :n + 1], mask[idx, :n],
+                                      COMPLEX)
+            expvals[idx] = probs @ signs
+        return expvals.to(node_features.dtype)
+
+    @torch.no_grad()
+    def __call__(self, x, edge_attr, edge_index, batch=None):
+        edge_index = edge_index.to(self.device).t()
+        if edge_attr is None:
+            edge_attr = torch.ones((edge_index.size(0), self.config['edge_input_dim']), device=self.device)
+        edge_features = math.pi * torch.tanh(apply_mlp(edge_attr.to(self.device).float(), self.artifact['input_edge']))
+        node_features = math.pi * torch.tanh(apply_mlp(x.to(self.device).float(), self.artifact['input_node']))
+
+        if self.star_planner == 'cover':
+            adjacency = adjacency_csr(edge_index, x.shape[0])
+        else:
+            csr = build_csr(edge_index)
+            order = star_order(csr, self.generator)
+        for i, hop in enumerate(self.artifact['hops']):
+            if self.star_planner == 'cover':
+                centers, nbr_idx, edge_idx, mask = cover_stars(adjacency, self.num_slots, self.generator, self.device)
+            else:
+                centers, nbr_idx, edge_idx, mask = sample_stars(csr, self.num_slots, order, self.generator)
+            aggr = self.quantum_messages(i, node_features, edge_features, centers, nbr_idx, edge_idx, mask)
+            updates = apply_mlp(torch.cat([node_features[centers], aggr], dim=1), hop['update'])
+            updates_node = torch.zeros_like(node_features).index_add(0, centers, updates)
+            if self.task == 'graph':
+                node_features = apply_norm(updates_node, hop['norm']) + node_features
+            else:
+                node_features = apply_norm(updates_node + node_features, hop['norm'])
+
+        if self.task == 'node':
+            return apply_mlp(torch.sigmoid(node_features), self.artifact['head'])
+        batch = torch.zeros(x.shape[0], dtype=torch.long, device=self.device) if batch is None else batch.to(self.device)
+        num_graphs = int(batch.max()) + 1 if batch.numel() else 0
+        pooled = torch.zeros(num_graphs, node_features.shape[1], dtype=node_features.dtype, device=self.device)
+        return apply_mlp(pooled.index_add(0, batch, node_features), self.artifact['head'])
@@ -0,0 +1,53 @@
+import torch
+
+from pauli import readout_observables, propagate, bloch_vectors, product_expvals
+
+
+# Fourier surrogate of the star circuit. Inputs only enter through the RX/RZ
+# encoding, so for fixed weights every readout expectation is a trigonometric
+# polynomial in the input angles. Propagating the readout observables through
+# the weight-only gates (pauli.propagate, no truncation) gives it exactly: a
+# Pauli string P contributes coeff * prod_w bloch_w[P_w], where the Bloch
+# components (sin a sin b, -sin a cos b, cos a) are the trigonometric basis
+# functions of wire w. The order of a term is its number of non-identity data
+# wires; dropping the terms above ``max_order`` changes any expectation by at
+# most the L1 norm of the dropped coefficients, since |bloch| <= 1.
+
+# Observables of the layer output (Z_center, Z_anc1, Z_anc2) among the 8 readout Z-strings
+READOUT = [4, 2, 1]
+
+
+def fit_surrogate(ops, num_slots, max_order=None):
+    """(codes, coeffs, bound) of the readout expectations for stars with ``num_slots`` occupied slots.
+
+    codes: (T, 2 * num_slots + 1) Pauli codes on the data wires, coeffs: (T, 3),
+    bound: (3,) worst-case error from the truncation to ``max_order``.
+    """
+    n_data = 2 * num_slots + 1
+    rdtype = torch.float64
+    device = ops[0].matrix.device if ops else None
+    codes, coeffs = readout_observables(num_slots, rdtype, device)
+    codes, coeffs = codes[READOUT], coeffs[READOUT][:, READOUT]
+    codes, coeffs = propagate(ops, codes, coeffs)
+
+    # Ancillas start in |0>: X and Y vanish, Z and I contribute 1
+    ancillas = codes[:, n_data:]
+    keep = ((ancillas == 1) | (ancillas == 2)).sum(1) == 0
+    codes, inverse = torch.unique(codes[keep, :n_data], dim=0, return_inverse=True)
+    coeffs = torch.zeros(codes.shape[0], coeffs.shape[1], dtype=rdtype, device=coeffs.device).index_add(
+        0, inverse, coeffs[keep])
+
+    bound = torch.zeros(coeffs.shape[1], dtype=rdtype, device=coeffs.device)
+    if max_order is not None:
+        tail = (codes != 0).sum(1) > max_order
+        bound = coeffs[tail].abs().sum(0)
+        codes, coeffs = codes[~tail], coeffs[~tail]
+    return codes, coeffs, bound
+
+
+def surrogate_expvals(codes, coeffs, edge_q, node_q):
+    # (B, 3) expectations from the encoded qubits of stars with matching neighbor count
+    bloch = bloch_vectors(torch.cat([edge_q, node_q], dim=1))
+    if codes.shape[0] == 0:
+        return bloch.new_zeros(bloch.shape[0], coeffs.shape[1])
+    return product_expvals(codes, coeffs.to(bloch.dtype), bloch)
@@ -1,13 +1,12 @@
 import torch
 import torch.nn as nn
-import numpy as numpy
 # import pennylane as qml
 # from pennylane import numpy as np
 # from torch_scatter import scatter_add
 import torch.nn.functional as F
 from torch_geometric.nn import MLP, global_add_pool, global_mean_pool, global_max_pool   
 
-from utils import star_subgraph
+from utils import adjacency_csr, plan_graphlets
 
 
 class HandcraftGNN(nn.Module):
@@ -84,25 +83,17 @@ class HandcraftGNN(nn.Module):
         edge_features = self.input_edge(edge_features)
         node_features = self.input_node(node_features)
         
-        idx_dict = {
-            (int(u), int(v)): i
-            for i, (u, v) in enumerate(edge_index.tolist())
-        }
             
         
         # edge_attributes = torch.zeros(num_nodes, num_nodes, self.final_dim, device=edge_attr.device)
         # edge_attributes[edge_index[:, 0], edge_index[:, 1]] = edge_features
         # edge_attributes[edge_index[:, 1], edge_index[:, 0]] = edge_features
 
-        edge_np = edge_index.cpu().numpy() 
-        rows = edge_np[:, 0]               
-        cols = edge_np[:, 1]               
-
-        adj_mtx = numpy.zeros((num_nodes, num_nodes), dtype=int)
-        adj_mtx[rows, cols] = 1
-        adj_mtx[cols, rows] = 1
+        adjacency = adjacency_csr(edge_index, num_nodes)
         
-        subgraphs = star_subgraph(adj_mtx, subgraph_size=self.graphlet_size)
+        stars = plan_graphlets(adjacency, self.graphlet_size - 1)
+        centers, nbr_idx, edge_idx, star_mask = (t.to(node_features.device) for t in stars)
+        star_rows = star_mask.nonzero(as_tuple=True)[0]
         
         for i in range(self.hop_neighbor):
             upd_layer = self.upds[f"lay{i+1}"]
@@ -110,32 +101,11 @@ class HandcraftGNN(nn.Module):
             
             norm_layer = self.norms[i]
             
-            # updates = [[] for _ in range(num_nodes)]  # each list holds candidate updates
-            updates_node = torch.zeros_like(node_features) ## UPDATES
-            
-            centers = []
-            updates = []
-            for sub in subgraphs:
-                center = sub[0]
-                neighbors = sub[1:]
-
-                n_feat = node_features[neighbors] 
-                # e_feat = edge_attributes[center, neighbors] 
-                edge_idxs = [ idx_dict[(center, int(n))] for n in neighbors ]
-                e_feat    = edge_features[edge_idxs]  
-                
-                inputs = torch.cat([e_feat, n_feat], dim=1)      
-                all_msg = msg_layer(inputs)   
-                aggr = torch.sum(all_msg, dim=0)   
-                new_center  = upd_layer(torch.cat([node_features[center], aggr], dim=0))
-                
-                centers.append(center)
-                updates.append(new_center)
-                
-                # updates[center].append(new_center)
-                # updates_node[center] = updates_node[center] + new_center  
-            centers = torch.tensor(centers, device=node_features.device)
-            updates = torch.stack(updates, dim=0) 
+            # Messages of all occupied slots at once, summed per star
+            inputs = torch.cat([edge_features[edge_idx[star_mask]], node_features[nbr_idx[star_mask]]], dim=1)
+            all_msg = msg_layer(inputs)
+            aggr = all_msg.new_zeros(centers.numel(), all_msg.shape[1]).index_add(0, star_rows, all_msg)
+            updates = upd_layer(torch.cat([node_features[centers], aggr], dim=1))
             
             # updates_node = scatter_add(updates, centers, dim=0,
             #            dim_size=node_features.size(0))
@@ -209,48 +179,28 @@ class HandcraftGNN_NodeClassification(nn.Module):
         node_features = self.input_node(node_features)        
         
         
-        idx_dict = {
-            (int(u), int(v)): i
-            for i, (u, v) in enumerate(edge_index.tolist())
-        }
             
         
         # edge_attributes = torch.zeros(num_nodes, num_nodes, self.final_dim, device=edge_attr.device)
         # edge_attributes[edge_index[:, 0], edge_index[:, 1]] = edge_features
         # edge_attributes[edge_index[:, 1], edge_index[:, 0]] = edge_features
 
-        edge_np = edge_index.cpu().numpy() 
-        rows = edge_np[:, 0]               
-        cols = edge_np[:, 1]               
-
-        adj_mtx = numpy.zeros((num_nodes, num_nodes), dtype=int)
-        adj_mtx[rows, cols] = 1
-        adj_mtx[cols, rows] = 1
+        adjacency = adjacency_csr(edge_index, num_nodes)
         
-        subgraphs = star_subgraph(adj_mtx, subgraph_size=self.graphlet_size)
+        stars = plan_graphlets(adjacency, self.graphlet_size - 1)
+        centers, nbr_idx, edge_idx, star_mask = (t.to(node_features.device) for t in stars)
+        star_rows = star_mask.nonzero(as_tuple=True)[0]
         
         for i in range(self.hop_neighbor):
             upd_layer = self.upds[f"lay{i+1}"]
             msg_layer = self.msgs[f"lay{i+1}"]
             
-            # updates = [[] for _ in range(num_nodes)]  # each list holds candidate updates
-            updates_node = node_features.clone() ## UPDATES
-            for sub in subgraphs:
-                center = sub[0]
-                neighbors = sub[1:]
-
-                n_feat = node_features[neighbors] 
-                # e_feat = edge_attributes[center, neighbors] 
-                edge_idxs = [ idx_dict[(center, int(n))] for n in neighbors ]
-                e_feat    = edge_features[edge_idxs]  
-                
-                inputs = torch.cat([e_feat, n_feat], dim=1)      
-                all_msg = msg_layer(inputs)   
-                aggr = torch.sum(all_msg, dim=0)   
-                
-                new_center  = upd_layer(torch.cat([node_features[center], aggr], dim=0))
-                # updates[center].append(new_center)
-                updates_node[center] = updates_node[center] + new_center  
+            # Messages of all occupied slots at once, summed per star
+            inputs = torch.cat([edge_features[edge_idx[star_mask]], node_features[nbr_idx[star_mask]]], dim=1)
+            all_msg = msg_layer(inputs)
+            aggr = all_msg.new_zeros(centers.numel(), all_msg.shape[1]).index_add(0, star_rows, all_msg)
+            updates = upd_layer(torch.cat([node_features[centers], aggr], dim=1))
+            updates_node = node_features.index_add(0, centers, updates)
             node_features = F.relu(updates_node)
                 
             # updates_node = []
@@ -1,55 +1,180 @@
 import torch
-import random
-from collections import defaultdict
 # from torchmetrics.classification import MulticlassF1Score
 
 
-def star_subgraph(adjacency_matrix, subgraph_size=4):
-    num_nodes = adjacency_matrix.shape[0]
-    subgraph_indices = []
-    uncovered_neighbors = set(range(num_nodes))  # All nodes should be covered as neighbors at least once
+def adjacency_csr(edge_index, num_nodes):
+    """Symmetric adjacency of (E, 2) (source, destination) edges as CSR (rowptr, col, edge_ids).
 
-    leaf_counts = defaultdict(int)
+    Neighbors are sorted and deduplicated, self-loops dropped, and ``edge_ids``
+    names an edge joining each pair, pointing into the row node when the graph
+    has one. Memory is O(E), unlike a dense (num_nodes, num_nodes) matrix.
+    """
+    edge_index = torch.as_tensor(edge_index).cpu().long()
+    ids = torch.arange(edge_index.shape[0])
+    rows = torch.cat([edge_index[:, 1], edge_index[:, 0]])
+    cols = torch.cat([edge_index[:, 0], edge_index[:, 1]])
+    ids = torch.cat([ids, ids])
+    keep = rows != cols
+    keys = rows[keep] * num_nodes + cols[keep]
+    # Stable sort keeps the into-row copy of each pair first
+    order = torch.sort(keys, stable=True).indices
+    keys, ids = keys[order], ids[keep][order]
+    first = torch.ones_like(keys, dtype=torch.bool)
+    first[1:] = keys[1:] != keys[:-1]
+    keys, ids = keys[first], ids[first]
+    rowptr = torch.zeros(num_nodes + 1, dtype=torch.long)
+    rowptr[1:] = torch.bincount(keys // num_nodes, minlength=num_nodes).cumsum(0)
+    return rowptr, keys % num_nodes, ids
 
-    seed_nodes = list(range(num_nodes))
-    random.shuffle(seed_nodes)
 
-    for center_node in seed_nodes:
-        neighbors = [i for i in range(num_nodes) if adjacency_matrix[center_node, i] != 0 and i != center_node]
-        k = subgraph_size - 1
+def graphlet_draws(num_nodes, num_entries, generator=None):
+    # Visiting order of the centers and one tie-break key per CSR entry
+    centers = torch.randperm(num_nodes, generator=generator)
+    return centers, torch.rand(num_entries, generator=generator, dtype=torch.float64)
 
-        candidates = neighbors  # Already excludes center node
 
-        # Case 1: Not enough neighbors → take all of them
-        if len(candidates) <= k:
-            sampled_neighbors = candidates
+def graphlet_waves(rowptr, col, centers, num_slots):
+    """Bounds of the runs of ``centers`` that ``plan_graphlets`` plans at once.
 
-        else:
-            available_new = list(set(candidates) & uncovered_neighbors)
+    A run ends before a center with more than ``num_slots`` neighbors that
+    shares a neighbor with an earlier center of the run: its choice depends on
+    that center's picks. Centers that take all their neighbors never end a run.
+    """
+    num_nodes = centers.numel()
+    counts = rowptr.diff()
+    position = torch.empty_like(centers)
+    position[centers] = torch.arange(num_nodes)
+    visitor = position[torch.repeat_interleave(torch.arange(num_nodes), counts)]
+    # Entries grouped by leaf in visiting order; each one sees the previous visitor of its leaf
+    order = torch.argsort(col * num_nodes + visitor)
+    leaves, visitor = col[order], visitor[order]
+    previous = torch.full_like(visitor, -1)
+    previous[1:] = torch.where(leaves[1:] == leaves[:-1], visitor[:-1], -1)
+    latest = torch.full((num_nodes,), -1, dtype=torch.long).scatter_reduce(0, visitor, previous, 'amax')
+    # A choosing center needs a run start in (latest, itself]; a center whose latest does not
+    # exceed an earlier one's is served by that center's start, so only records can start runs
+    latest = torch.where(counts[centers] > num_slots, latest, -1)
+    earlier = torch.cat([latest.new_full((1,), -1), latest.cummax(0).values[:-1]])
+    starts = torch.cat([latest.new_zeros(1), (latest > earlier).nonzero(as_tuple=True)[0]])
+    # Greedy over the records: after a start, the next one is the first record whose latest
+    # reaches it. Follow that chain from 0 by pointer doubling (last entry = past the end)
+    jump = torch.cat([torch.searchsorted(latest[starts], starts), starts.new_full((1,), starts.numel())])
+    taken = torch.zeros(starts.numel() + 1, dtype=torch.bool)
+    taken[0] = True
+    for _ in range(starts.numel().bit_length()):
+        taken[jump[taken]] = True
+        jump = jump[jump]
+    return starts[taken[:-1]].tolist() + [num_nodes]
+
+
+def plan_graphlets(adjacency, num_slots, generator=None):
+    """Star graphlets covering every node of an ``adjacency_csr`` graph, as padded tensors.
+
+    Centers are visited in random order. A center with at most ``num_slots``
+    neighbors takes all of them; otherwise it prefers neighbors no earlier star
+    used as a leaf (picked at random), then the least-used leaves. The plan is
+    plan of visiting the centers one by one, computed for whole runs of
+    centers that cannot affect each other (``graphlet_waves``) at once.
+    Returns centers and (num_nodes, num_slots) nbr_idx, edge_idx (zero in empty
+    slots) and occupancy mask, on the CPU.
+    """
+    rowptr, col, edge_ids = adjacency
+    num_nodes = rowptr.numel() - 1
+    counts = rowptr.diff()
+    centers, noise = graphlet_draws(num_nodes, col.numel(), generator)
+    uncovered = torch.ones(num_nodes, dtype=torch.bool)
+    leaf_counts = torch.zeros(num_nodes, dtype=torch.float64)
+    nbr_idx = torch.zeros(num_nodes, num_slots, dtype=torch.long)
+    edge_idx = torch.zeros(num_nodes, num_slots, dtype=torch.long)
+    mask = torch.arange(num_slots) < counts[centers].clamp(max=num_slots).unsqueeze(1)
+    bounds = graphlet_waves(rowptr, col, centers, num_slots)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        wave = centers[start:stop]
+        lengths = counts[wave]
+        star = torch.repeat_interleave(torch.arange(wave.numel()), lengths)
+        offsets = torch.arange(star.numel()) - (lengths.cumsum(0) - lengths)[star]
+        pos = rowptr[wave][star] + offsets
+        leaves = col[pos]
+        # Uncovered leaves first, then by use count, random among equals; stars that fit keep CSR order
+        keys = torch.where(uncovered[leaves], noise[pos], 1 + leaf_counts[leaves] + noise[pos] / 2)
+        keys = torch.where(lengths[star] > num_slots, keys, 0.0)
+        ranked = torch.sort(keys, stable=True).indices
+        ranked = ranked[torch.sort(star[ranked], stable=True).indices]
+        # ``ranked`` is grouped by star like ``pos``, so ``offsets`` is each entry's rank in its star
+        taken = offsets < num_slots
+        chosen = ranked[taken]
+        rows, slots = start + star[taken], offsets[taken]
+        nbr_idx[rows, slots] = leaves[chosen]
+        edge_idx[rows, slots] = edge_ids[pos[chosen]]
+        uncovered[leaves[chosen]] = False
+        leaf_counts.index_add_(0, leaves[chosen], torch.ones(chosen.numel(), dtype=torch.float64))
+    return centers, nbr_idx, edge_idx, mask
+
+
+def cover_stars(adjacency, num_slots, generator=None, device=None):
+    # ``plan_graphlets`` stars on ``device`` without the neighborless ones (for the quantum layers)
+    planned = plan_graphlets(adjacency, num_slots, generator=generator)
+    occupied = planned[3].any(1)
+    return tuple(t[occupied].to(device) for t in planned)
+
+
+def build_csr(edge_index):
+    """Destination-sorted CSR of (E, 2) (source, destination) edges: (dst_nodes, rowptr, col, edge_ids).
+
+    The neighbors of ``dst_nodes[k]`` are ``col[rowptr[k]:rowptr[k + 1]]``, reached
+    over the edges ``edge_ids[rowptr[k]:rowptr[k + 1]]`` in their original order.
+    """
+    edge_ids = torch.sort(edge_index[:, 1], stable=True).indices
+    dst_nodes, counts = torch.unique_consecutive(edge_index[edge_ids, 1], return_counts=True)
+    rowptr = torch.cat([counts.new_zeros(1), counts.cumsum(0)])
+    return dst_nodes, rowptr, edge_index[edge_ids, 0], edge_ids
+
+
+def seeded_generator(generator, seed, device):
+    # ``generator`` while it lives on ``device``, else a fresh one seeded with ``seed`` (None: global RNG)
+    if seed is None:
+        return None
+    if generator is None or generator.device != torch.device(device):
+        generator = torch.Generator(device=device)
+        generator.manual_seed(seed)
+    return generator
 
-            # Case 2a: enough new nodes → sample from them
-            if len(available_new) >= k:
-                sampled_neighbors = random.sample(available_new, k)
 
-            # Case 2b: not enough new nodes → take all + fill from candidates
-            else:
-                sampled_neighbors = available_new
-                remaining_k = k - len(sampled_neighbors)
-                remaining_pool = list(set(candidates) - set(sampled_neighbors))
-                remaining_pool.sort(key=lambda x: leaf_counts[x])
+def star_order(csr, generator=None):
+    # Random order of the CSR rows (centers)
+    device = csr[1].device
+    order = torch.randperm(csr[0].numel(), generator=generator,
+                           device=device if generator is None else generator.device)
+    return order.to(device)
 
-                sampled_neighbors += remaining_pool[:remaining_k]
 
-        # Update uncovered neighbor set
-        uncovered_neighbors -= set(sampled_neighbors)
-        for node in sampled_neighbors:
-            leaf_counts[node] += 1
+def sample_stars(csr, num_slots, order=None, generator=None):
+    """Padded stars of all destination nodes of ``csr`` with at most ``num_slots`` sampled neighbors.
 
-        # Add center + its sampled neighbors
-        subgraph = [center_node] + sampled_neighbors
-        subgraph_indices.append(subgraph)
+    ``csr`` comes from ``build_csr``; centers follow ``order`` (CSR row indices,
+    random when None). Stars with more neighbors keep a uniform random subset
+    of them, picked for all centers at once by a segmented top-k over random
+    keys drawn from ``generator``. Returns centers and (num_centers, num_slots)
+    nbr_idx, edge_idx (zero in empty slots) and occupancy mask.
+    """
+    dst_nodes, rowptr, col, edge_ids = csr
+    device = col.device
+    if order is None:
+        order = star_order(csr, generator)
+    counts = rowptr.diff()
+    star = torch.repeat_interleave(torch.arange(counts.numel(), device=device), counts)
+    # Stars that fit keep their edge order (equal keys under a stable sort)
+    keys = torch.rand(col.numel(), generator=generator, device=device if generator is None else generator.device)
+    keys = torch.where(counts[star] > num_slots, keys.to(device), 0.0)
+    ranked = torch.sort(keys, stable=True).indices
+    ranked = ranked[torch.sort(star[ranked], stable=True).indices]
 
-    return subgraph_indices
+    slots = torch.arange(num_slots, device=device)
+    mask = slots < counts.clamp(max=num_slots)[order].unsqueeze(1)
+    picked = ranked[(rowptr[:-1][order].unsqueeze(1) + slots).clamp(max=max(col.numel() - 1, 0))]
+    nbr_idx = torch.where(mask, col[picked], 0)
+    edge_idx = torch.where(mask, edge_ids[picked], 0)
+    return dst_nodes[order], nbr_idx, edge_idx, mask
 
 
 def train_graph(model, optimizer, loader, criterion, device):
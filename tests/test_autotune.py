@@ -0,0 +1,81 @@
+import argparse
+import random
+
+import pytest
+import torch
+from torch_geometric.data import Data
+
+import autotune
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def make_args(**overrides):
+    # The main.py options autotune reads, at their defaults
+    args = dict(dataset='MUTAG', task='graph', model='qgnn', graphlet_size=3, num_gnn_layers=2, num_ent_layers=2,
+                backend='pennylane', diff_method='backprop', precision='double', no_fusion=False, max_bond=16,
+                chunk_size=None, batch_size=8, depolarizing=0.0, damping=0.0, trajectories=16,
+                checkpoint_hops=False)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def ring_graphs(count=4, nodes=6):
+    edge_index = torch.stack([torch.arange(nodes), (torch.arange(nodes) + 1) % nodes])
+    return [Data(edge_index=torch.cat([edge_index, edge_index.flip(0)], dim=1), num_nodes=nodes)
+            for _ in range(count)]
+
+
+@pytest.fixture
+def trials(monkeypatch):
+    # Timed configurations; the fake timing favours rdm, chunk size 64, batch size 16 and one thread
+    seen = []
+
+    def time_trial(make_model, config, train_data, task, device, steps=2):
+        seen.append(dict(config))
+        elapsed = (1.0 if config['backend'] == 'rdm' else 2.0) + (config['chunk_size'] != 64)
+        return elapsed + (config['batch_size'] != 16) + 0.1 * config['threads'], None
+
+    monkeypatch.setattr(autotune, 'time_trial', time_trial)
+    return seen
+
+
+def test_tune_keeps_the_fastest_value_of_each_setting(trials):
+    best = autotune.tune(make_args(), None, w_shapes(3), ring_graphs(), 'cpu', None, log=lambda msg: None)
+    assert best == {'backend': 'rdm', 'diff_method': 'backprop', 'chunk_size': 64, 'batch_size': 16, 'threads': 1}
+    # An explicit backend is kept
+    best = autotune.tune(make_args(backend='statevector', diff_method='adjoint'), None, w_shapes(3), ring_graphs(),
+                         'cpu', None, log=lambda msg: None)
+    assert (best['backend'], best['diff_method']) == ('statevector', 'adjoint')
+
+
+def test_tune_skips_configurations_over_the_memory_cap(trials):
+    with pytest.raises(ValueError, match='No configuration fits'):
+        autotune.tune(make_args(), None, w_shapes(3), ring_graphs(), 'cpu', 1, log=lambda msg: None)
+    assert not trials
+
+
+def test_autotune_caches_per_setup_and_restores_the_rngs(trials, tmp_path):
+    path = str(tmp_path / 'autotune.json')
+    args = make_args()
+    torch.manual_seed(0)
+    random.seed(0)
+    expected = torch.rand(1), random.random()
+    torch.manual_seed(0)
+    random.seed(0)
+    config = autotune.autotune(args, None, w_shapes(3), ring_graphs(), 'cpu', None, path, log=lambda msg: None)
+    assert (torch.rand(1), random.random()) == expected
+    timed = len(trials)
+    assert autotune.autotune(args, None, w_shapes(3), ring_graphs(), 'cpu', None, path, log=lambda msg: None) == config
+    assert len(trials) == timed
+    # Another graphlet size is tuned separately; --retune redoes the trials
+    autotune.autotune(make_args(graphlet_size=4), None, w_shapes(4), ring_graphs(), 'cpu', None, path,
+                      log=lambda msg: None)
+    autotune.autotune(args, None, w_shapes(3), ring_graphs(), 'cpu', None, path, retune=True, log=lambda msg: None)
+    assert len(trials) == 3 * timed
+    assert len(autotune.load_cache(path)) == 2
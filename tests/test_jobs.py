@@ -0,0 +1,60 @@
+import math
+
+import torch
+
+from jobs import FakeRemoteBackend, JobBatcher
+from qsim import StarCircuitLayer
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def random_stars(num_slots, batch=12, seed=0):
+    # Stars of every size up to ``num_slots`` neighbors
+    generator = torch.Generator().manual_seed(seed)
+    node_features = (torch.rand(20, 2, generator=generator, dtype=torch.float64) * math.pi).requires_grad_()
+    edge_features = (torch.rand(40, 2, generator=generator, dtype=torch.float64) * math.pi).requires_grad_()
+    centers = torch.randint(20, (batch,), generator=generator)
+    nbr_idx = torch.randint(20, (batch, num_slots), generator=generator)
+    edge_idx = torch.randint(40, (batch, num_slots), generator=generator)
+    counts = torch.linspace(0, num_slots, batch).round().long()
+    mask = torch.arange(num_slots) < counts.unsqueeze(1)
+    return node_features, edge_features, centers, nbr_idx, edge_idx, mask
+
+
+def run_layer(job_batcher=None, **options):
+    # Expectations, gradients and circuit count of one training step
+    torch.manual_seed(0)
+    layer = StarCircuitLayer(w_shapes(3), job_batcher=job_batcher, **options).double()
+    stars = random_stars(2)
+    expvals = layer(*stars)
+    expvals.sum().backward()
+    grads = [param.grad for param in layer.parameters() if param.grad is not None]
+    return expvals.detach(), grads, layer.circuits_per_step()
+
+
+def test_jobs_match_a_direct_run():
+    # Two-star jobs on four workers return the single-call results in star order
+    exact, exact_grads, _ = run_layer(diff_method='parameter-shift')
+    with JobBatcher(FakeRemoteBackend(latency=0.0, max_workers=4), job_size=2) as batcher:
+        expvals, grads, _ = run_layer(batcher, diff_method='parameter-shift')
+        report = batcher.report()
+    assert torch.allclose(expvals, exact)
+    for grad, exact_grad in zip(grads, exact_grads):
+        assert torch.allclose(grad, exact_grad)
+    assert report['circuits'] == 12 and report['jobs'] == 7
+
+
+def test_concurrent_jobs_share_counters_and_seeds():
+    # Every job's circuits are counted, and seeded shots do not depend on thread timing
+    options = dict(diff_method='parameter-shift', shots=256, seed=3)
+    _, _, expected_circuits = run_layer(**options)
+    with JobBatcher(FakeRemoteBackend(latency=0.0, max_workers=4), job_size=1) as batcher:
+        first, _, circuits = run_layer(batcher, **options)
+        second, _, _ = run_layer(batcher, **options)
+    assert circuits == expected_circuits
+    assert torch.equal(first, second)
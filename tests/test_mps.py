@@ -0,0 +1,50 @@
+import math
+
+import pytest
+import torch
+
+from mps import chain_order
+from qsim import StarCircuitLayer
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def random_stars(num_slots, batch=6, seed=0):
+    # Stars of every size up to ``num_slots`` neighbors
+    generator = torch.Generator().manual_seed(seed)
+    node_features = torch.rand(40, 2, generator=generator, dtype=torch.float64) * math.pi
+    edge_features = torch.rand(120, 2, generator=generator, dtype=torch.float64) * math.pi
+    centers = torch.randint(40, (batch,), generator=generator)
+    nbr_idx = torch.randint(40, (batch, num_slots), generator=generator)
+    edge_idx = torch.randint(120, (batch, num_slots), generator=generator)
+    counts = torch.linspace(1, num_slots, batch).round().long()
+    mask = torch.arange(num_slots) < counts.unsqueeze(1)
+    return node_features, edge_features, centers, nbr_idx, edge_idx, mask
+
+
+def test_chain_order_keeps_pairs_adjacent():
+    for slot in range(5):
+        order = chain_order(5, slot)
+        assert sorted(order) == list(range(13))
+        for i in range(5):
+            assert abs(order.index(i) - order.index(6 + i)) == 1
+        assert order.index(5) == order.index(6 + slot) + 1
+
+
+@pytest.mark.parametrize('graphlet_size, num_ent_layers', [(10, 2), (10, 3), (16, 2)])
+def test_mps_matches_rdm_on_wide_graphlets(graphlet_size, num_ent_layers):
+    torch.manual_seed(0)
+    rdm = StarCircuitLayer(w_shapes(graphlet_size, num_ent_layers), backend='rdm')
+    mps = StarCircuitLayer(w_shapes(graphlet_size, num_ent_layers), backend='mps', max_bond=16)
+    mps.load_state_dict(rdm.state_dict())
+    stars = random_stars(graphlet_size - 1)
+    with torch.no_grad():
+        expected = rdm(*stars)
+        expvals = mps(*stars)
+    assert mps.truncation_error < 1e-12
+    assert torch.allclose(expvals, expected, atol=1e-10)
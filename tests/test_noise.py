@@ -0,0 +1,79 @@
+import math
+
+import pytest
+import torch
+
+from qsim import StarCircuitLayer, amplitude_damp, depolarize, pauli_matrices
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def random_stars(num_slots, batch=12, seed=0):
+    # Stars of every size up to ``num_slots`` neighbors
+    generator = torch.Generator().manual_seed(seed)
+    node_features = torch.rand(20, 2, generator=generator, dtype=torch.float64) * math.pi
+    edge_features = torch.rand(40, 2, generator=generator, dtype=torch.float64) * math.pi
+    centers = torch.randint(20, (batch,), generator=generator)
+    nbr_idx = torch.randint(20, (batch, num_slots), generator=generator)
+    edge_idx = torch.randint(40, (batch, num_slots), generator=generator)
+    counts = torch.linspace(0, num_slots, batch).round().long()
+    mask = torch.arange(num_slots) < counts.unsqueeze(1)
+    return node_features, edge_features, centers, nbr_idx, edge_idx, mask
+
+
+def unraveled_rho(channel, rows=200000):
+    # Mean density matrix of ``rows`` trajectories of one qubit through ``channel``
+    psi = torch.tensor([0.6, 0.8j], dtype=torch.complex128)
+    state = channel(psi.expand(rows, 2).clone(), torch.Generator().manual_seed(0))
+    return torch.einsum('bi,bj->ij', state, state.conj()) / rows, torch.outer(psi, psi.conj())
+
+
+def test_depolarize_unravels_the_depolarizing_channel():
+    p = torch.full((200000,), 0.3, dtype=torch.float64)
+    rho, rho0 = unraveled_rho(lambda state, generator: depolarize(state, 0, p, generator))
+    paulis = pauli_matrices(torch.complex128)
+    expected = (1 - 0.3) * rho0 + 0.1 * sum(sigma @ rho0 @ sigma for sigma in paulis[1:])
+    assert (rho - expected).abs().max() < 5e-3
+
+
+def test_amplitude_damp_unravels_the_damping_channel():
+    gamma = torch.full((200000,), 0.4, dtype=torch.float64)
+    rho, rho0 = unraveled_rho(lambda state, generator: amplitude_damp(state, 0, gamma, generator))
+    k0 = torch.tensor([[1, 0], [0, math.sqrt(0.6)]], dtype=torch.complex128)
+    k1 = torch.tensor([[0, math.sqrt(0.4)], [0, 0]], dtype=torch.complex128)
+    expected = k0 @ rho0 @ k0.conj().T + k1 @ rho0 @ k1.conj().T
+    assert (rho - expected).abs().max() < 5e-3
+
+
+def noisy_layer(**options):
+    torch.manual_seed(0)
+    return StarCircuitLayer(w_shapes(3), **options).double()
+
+
+def test_zero_noise_reuses_the_noiseless_engine():
+    stars = random_stars(2)
+    layer = noisy_layer(depolarizing=0.0, damping=0.0, trajectories=8, seed=1)
+    assert not layer.noisy
+    with torch.no_grad():
+        assert torch.equal(layer(*stars), noisy_layer()(*stars))
+    assert layer.noise_stderr == 0.0
+
+
+@pytest.mark.parametrize('noise', [{'depolarizing': 0.05}, {'damping': 0.1}])
+def test_seeded_trajectories_report_their_standard_error(noise):
+    stars = random_stars(2)
+    with torch.no_grad():
+        exact = noisy_layer()(*stars)
+        few = noisy_layer(trajectories=16, seed=1, **noise)
+        expvals = few(*stars)
+        assert torch.equal(expvals, noisy_layer(trajectories=16, seed=1, **noise)(*stars))
+        many = noisy_layer(trajectories=256, seed=1, **noise)
+        many(*stars)
+    # Noise moves the readout, and the error bar shrinks like 1/sqrt(trajectories)
+    assert not torch.allclose(expvals, exact)
+    assert 0 < many.noise_stderr < few.noise_stderr / 2
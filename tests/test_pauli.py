@@ -0,0 +1,52 @@
+import math
+
+import pytest
+import torch
+
+from qsim import StarCircuitLayer
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def random_stars(num_slots, batch=8, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    node_features = torch.rand(30, 2, generator=generator, dtype=torch.float64) * math.pi
+    edge_features = torch.rand(60, 2, generator=generator, dtype=torch.float64) * math.pi
+    centers = torch.randint(30, (batch,), generator=generator)
+    nbr_idx = torch.randint(30, (batch, num_slots), generator=generator)
+    edge_idx = torch.randint(60, (batch, num_slots), generator=generator)
+    counts = torch.linspace(1, num_slots, batch).round().long()
+    return node_features, edge_features, centers, nbr_idx, edge_idx, torch.arange(num_slots) < counts.unsqueeze(1)
+
+
+def layers(graphlet_size, weight_scale=1.0, **options):
+    torch.manual_seed(0)
+    rdm = StarCircuitLayer(w_shapes(graphlet_size), backend='rdm')
+    with torch.no_grad():
+        for param in rdm.parameters():
+            param.mul_(weight_scale)
+    pauli = StarCircuitLayer(w_shapes(graphlet_size), backend='pauli', **options)
+    pauli.load_state_dict(rdm.state_dict())
+    return rdm, pauli
+
+
+def test_coefficient_truncation_matches_rdm_for_small_weights():
+    # Near-identity weights (|theta| < 0.05): the error stays at the order of min_coeff
+    rdm, pauli = layers(5, weight_scale=0.05 / (2 * math.pi), pauli_min_coeff=1e-3)
+    stars = random_stars(4)
+    with torch.no_grad():
+        expected, expvals = rdm(*stars), pauli(*stars)
+    assert (expvals - expected).abs().max() < 5e-3
+    assert pauli.pauli_terms < 1000
+
+
+def test_term_budget_stops_untruncated_propagation():
+    # Uniform weights at graphlet_size 4 need about 250k terms
+    _, pauli = layers(4, pauli_max_terms=20000)
+    with torch.no_grad(), pytest.raises(ValueError, match='exceeded 20000 terms'):
+        pauli(*random_stars(3))
@@ -0,0 +1,142 @@
+import math
+
+import pennylane as qml
+import pytest
+import torch
+
+from model import make_qconv, qgcn_enhance_layer, quantum_messages
+from qsim import StarCircuitLayer, z_signs
+
+# Star circuits of graphlet_size 3 (two neighbor slots, 7 wires), as built by main.py
+# with --graphlet_size 3 --num_ent_layers 2
+W_SHAPES = {
+    'spreadlayer': (0, 5, 1),
+    'inits': (1, 2),
+    'strong': (1, 2, 2, 3),
+    'update': (3, 1, 4, 3),
+    'twodesign': (0, 2, 1, 2),
+}
+# Torch engines against the QNode: (backend, diff_method)
+ENGINES = [('statevector', 'backprop'), ('statevector', 'adjoint'), ('statevector', 'parameter-shift'),
+           ('rdm', 'backprop'), ('mps', 'backprop'), ('pauli', 'backprop')]
+TOLERANCES = {'double': 1e-9, 'single': 1e-4}
+
+
+def reference_circuit(inputs, spreadlayer, strong, twodesign, inits, update):
+    # qgcn_enhance_layer with its PauliZ readout replaced by the (center, anc1, anc2)
+    # probabilities the torch engines return
+    tape = qml.tape.make_qscript(qgcn_enhance_layer)(inputs, spreadlayer, strong, twodesign, inits, update)
+    for op in tape.operations:
+        qml.apply(op)
+    return qml.probs(wires=[m.wires[0] for m in tape.measurements])
+
+
+def star_graph():
+    # A full star, a partial one (padded slot) and a neighborless one
+    generator = torch.Generator().manual_seed(0)
+    node_features = (torch.rand(5, 2, generator=generator, dtype=torch.float64) * math.pi).requires_grad_()
+    edge_features = (torch.rand(4, 2, generator=generator, dtype=torch.float64) * math.pi).requires_grad_()
+    centers = torch.tensor([0, 1, 4])
+    nbr_idx = torch.tensor([[1, 2], [3, 0], [0, 0]])
+    edge_idx = torch.tensor([[0, 1], [2, 0], [0, 0]])
+    mask = torch.tensor([[True, True], [True, False], [False, False]])
+    return node_features, edge_features, centers, nbr_idx, edge_idx, mask
+
+
+def make_layer(backend='statevector', **options):
+    # Double weights, so the QNode reference is exact to round-off
+    torch.manual_seed(0)
+    return StarCircuitLayer(W_SHAPES, backend=backend, **options).double()
+
+
+def reference_probs(layer, node_features, edge_features, centers, nbr_idx, edge_idx, mask):
+    # (B, 8) probabilities of every star from the QNode, run on just the wires the star uses
+    qnode = qml.QNode(reference_circuit, qml.device('default.qubit'), interface='torch', diff_method='backprop')
+    weights = {name: param for name, param in layer.named_parameters()}
+    probs = []
+    for b in range(centers.shape[0]):
+        n = int(mask[b].sum())
+        inputs = torch.cat([edge_features[edge_idx[b, :n]],
+                            node_features[torch.cat([centers[b:b + 1], nbr_idx[b, :n]])]])
+        probs.append(qnode(inputs.flatten(), **weights))
+    return torch.stack(probs)
+
+
+def engine_probs(layer, *stars):
+    # (B, 8) probabilities of the layer's engine, the way StarCircuitLayer.forward runs it
+    edge_q, node_q = layer.star_inputs(*stars, cdtype=layer.cdtype)
+    ops = layer.program() if layer.parameter_shift else layer.compile_ops(cdtype=layer.cdtype)
+    probs, _ = layer.simulate(ops, edge_q, node_q, stars[-1], layer.cdtype)
+    return probs
+
+
+def gradients(probs, layer, node_features, edge_features):
+    # Gradients of a fixed random linear function of the probabilities
+    upstream = torch.randn(probs.shape, generator=torch.Generator().manual_seed(1), dtype=torch.float64)
+    inputs = [getattr(layer, name) for name in ('strong', 'inits', 'update')] + [node_features, edge_features]
+    return torch.autograd.grad((probs.double() * upstream).sum(), inputs)
+
+
+@pytest.mark.parametrize('fusion', [True, False])
+@pytest.mark.parametrize('precision', ['double', 'single'])
+@pytest.mark.parametrize('backend, diff_method', ENGINES)
+def test_engine_matches_qnode(backend, diff_method, precision, fusion):
+    layer = make_layer(backend, diff_method=diff_method, precision=precision, fusion=fusion)
+    stars = star_graph()
+    expected = reference_probs(layer, *stars)
+    probs = engine_probs(layer, *stars)
+    tol = TOLERANCES[precision]
+    assert torch.allclose(probs.double(), expected, atol=tol)
+    for grad, expected_grad in zip(gradients(probs, layer, *stars[:2]), gradients(expected, layer, *stars[:2])):
+        assert torch.allclose(grad.double(), expected_grad.double(), atol=10 * tol)
+
+
+@pytest.mark.parametrize('backend, diff_method', ENGINES)
+def test_layer_expvals_match_qnode(backend, diff_method):
+    layer = make_layer(backend, diff_method=diff_method)
+    stars = star_graph()
+    expected = reference_probs(layer, *stars) @ z_signs(3)
+    assert torch.allclose(layer(*stars), expected, atol=1e-9)
+    # Second call runs on the cached ops
+    assert torch.allclose(layer(*stars), expected, atol=1e-9)
+
+
+def test_surrogate_matches_qnode():
+    layer = make_layer(surrogate_order=2 * W_SHAPES['update'][0] + 3).eval()
+    stars = star_graph()
+    expected = reference_probs(layer, *stars) @ z_signs(3)
+    with torch.no_grad():
+        assert torch.allclose(layer(*stars), expected.detach(), atol=1e-9)
+    assert layer.surrogate_bound < 1e-9
+
+
+def test_pennylane_layer_matches_qnode():
+    # Size-bucketed broadcast calls of the pooled TorchLayer
+    torch.manual_seed(0)
+    q_layer = make_qconv(qml.device('default.qubit', wires=7), W_SHAPES).double()
+    stars = star_graph()
+    expected = reference_probs(q_layer, *stars) @ z_signs(3)
+    assert torch.allclose(quantum_messages(q_layer, *stars), expected, atol=1e-9)
+
+
+@pytest.mark.parametrize('backend', ['statevector', 'pauli'])
+def test_forwards_before_backwards_keep_their_graphs(backend):
+    # Two forwards and an input-only torch.autograd.grad before the weight backwards
+    layer = make_layer(backend)
+    stars = star_graph()
+    first, second = layer(*stars), layer(*stars)
+    torch.autograd.grad(first.sum(), stars[0], retain_graph=True)
+    first.sum().backward()
+    expected = layer.strong.grad.clone()
+    layer.zero_grad()
+    second.sum().backward()
+    assert torch.allclose(layer.strong.grad, expected)
+
+
+def test_eval_reuses_ops_until_weights_change():
+    layer = make_layer()
+    with torch.no_grad():
+        ops = layer.cached_ops()
+        assert layer.cached_ops() is ops
+        layer.strong.add_(0.1)
+        assert layer.cached_ops() is not ops
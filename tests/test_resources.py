@@ -0,0 +1,65 @@
+import pytest
+import torch
+from torch_geometric.data import Data
+
+from resources import AUTO_CANDIDATES, estimate_resources, select_backend, star_histogram
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def star_graph(num_leaves):
+    # Hub 0 with ``num_leaves`` leaves, edges in both directions
+    leaves = torch.arange(1, num_leaves + 1)
+    edge_index = torch.stack([torch.cat([leaves, torch.zeros_like(leaves)]),
+                              torch.cat([torch.zeros_like(leaves), leaves])])
+    return Data(edge_index=edge_index, num_nodes=num_leaves + 1)
+
+
+def estimate(graphs, graphlet_size=3, **options):
+    return estimate_resources(w_shapes(graphlet_size), graphs, graphs, batch_size=2, hops=2, **options)
+
+
+def test_star_histogram_clamps_degrees_to_the_slots():
+    histogram = star_histogram([star_graph(1), star_graph(5)], num_slots=2)
+    # star_graph(1): two centers of degree 1; star_graph(5): five leaves, plus the hub clamped to 2
+    assert histogram.tolist() == [[0, 2, 0], [0, 5, 1]]
+
+
+def test_estimate_follows_the_degree_distribution():
+    graphs = [star_graph(1), star_graph(5)]
+    backprop, adjoint = estimate(graphs), estimate(graphs, diff_method='adjoint')
+    # Widest star: center, two neighbors, two edges and two ancillas, in complex128
+    assert backprop['wires'] == 7 and backprop['state_bytes'] == 2 ** 7 * 16
+    # 8 stars, evaluated once in training and once in evaluation, per hop
+    assert backprop['circuits_per_epoch'] == 2 * 2 * 8
+    assert adjoint['peak_bytes'] < backprop['peak_bytes']
+    assert estimate(graphs, checkpoint_hops=True)['peak_bytes'] * 2 == backprop['peak_bytes']
+    assert estimate([star_graph(1)])['wires'] == 5
+
+
+def test_select_backend_prefers_the_cheapest_exact_fit():
+    graphs = [star_graph(1), star_graph(5)]
+    estimates = [estimate(graphs, backend=backend, diff_method=diff_method) for backend, diff_method in AUTO_CANDIDATES]
+    cheapest = min(estimates, key=lambda e: e['cost'])
+    assert select_backend(estimates, None) is cheapest
+    # A budget just under the cheapest peak moves to the next one that fits
+    fits = select_backend(estimates, cheapest['peak_bytes'] - 1)
+    assert fits['peak_bytes'] < cheapest['peak_bytes']
+    approximate = dict(estimates[0], exact=False, cost=0)
+    assert select_backend(estimates + [approximate], None) is cheapest
+
+
+def test_select_backend_refuses_infeasible_graphlets():
+    # graphlet_size 12 needs 25 wires: 512 MiB per statevector
+    estimates = [estimate([star_graph(11)], graphlet_size=12, backend=backend, diff_method=diff_method)
+                 for backend, diff_method in AUTO_CANDIDATES[:2]]
+    assert estimates[0]['wires'] == 25
+    with pytest.raises(ValueError, match='No simulation backend fits'):
+        select_backend(estimates, 2 ** 30)
+    with pytest.raises(ValueError, match='Pass --backend explicitly'):
+        select_backend([estimate([star_graph(1)], backend='pauli')], None)
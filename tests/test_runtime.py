@@ -0,0 +1,54 @@
+import pennylane as qml
+import pytest
+import torch
+
+from export import export_model
+from model import QGNNGraphClassifier, QGNNNodeClassifier
+from runtime import QGNNRuntime
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def graph_batch(nodes=7, seed=0):
+    # Two random graphs of ``nodes`` nodes each, as one batch
+    generator = torch.Generator().manual_seed(seed)
+    edges = torch.randint(nodes, (2, 3 * nodes), generator=generator)
+    edges = edges[:, edges[0] != edges[1]]
+    edge_index = torch.cat([edges, edges + nodes], dim=1)
+    edge_index = torch.cat([edge_index, edge_index.flip(0)], dim=1)
+    node_feat = torch.rand(2 * nodes, 2, generator=generator)
+    edge_attr = torch.rand(edge_index.shape[1], 1, generator=generator)
+    return node_feat, edge_attr, edge_index, torch.arange(2).repeat_interleave(nodes)
+
+
+def trained_model(classifier, backend, star_planner):
+    torch.manual_seed(0)
+    q_dev = qml.device('default.qubit', wires=7) if backend == 'pennylane' else None
+    model = classifier(q_dev, w_shapes(3), hidden_dim=8, node_input_dim=2, graphlet_size=3, hop_neighbor=2,
+                       num_classes=3, backend=backend, sampling_seed=5, star_planner=star_planner)
+    # A few train-mode forwards move the batch norm statistics away from their initial values
+    with torch.no_grad():
+        for seed in range(3):
+            model(*graph_batch(seed=seed + 1))
+    return model.eval()
+
+
+@pytest.mark.parametrize('classifier', [QGNNGraphClassifier, QGNNNodeClassifier])
+@pytest.mark.parametrize('backend, star_planner', [('statevector', 'sample'), ('statevector', 'cover'),
+                                                    ('pennylane', 'sample')])
+def test_runtime_matches_model_eval(classifier, backend, star_planner, tmp_path):
+    model = trained_model(classifier, backend, star_planner)
+    path = tmp_path / 'model.pt'
+    export_model(model, path)
+    # Fresh seeded samplers on both sides draw the same stars
+    model._sampler = None
+    with torch.no_grad():
+        expected = model(*graph_batch())
+    logits = QGNNRuntime(path, seed=5)(*graph_batch())
+    assert logits.shape == expected.shape
+    assert torch.allclose(logits, expected, atol=1e-5)
@@ -0,0 +1,73 @@
+import math
+
+import torch
+
+from qsim import StarCircuitLayer, allocate_shots, sample_probs, z_signs
+
+
+def w_shapes(graphlet_size, num_ent_layers=2):
+    # As main.py builds them for --graphlet_size / --num_ent_layers
+    n_qubits = 2 * graphlet_size - 1
+    return {'spreadlayer': (0, n_qubits, 1), 'inits': (1, 2), 'strong': (1, num_ent_layers, 2, 3),
+            'update': (graphlet_size, num_ent_layers - 1, 4, 3), 'twodesign': (0, num_ent_layers, 1, 2)}
+
+
+def random_stars(num_slots, batch=12, seed=0):
+    # Stars of every size up to ``num_slots`` neighbors
+    generator = torch.Generator().manual_seed(seed)
+    node_features = torch.rand(20, 2, generator=generator, dtype=torch.float64) * math.pi
+    edge_features = torch.rand(40, 2, generator=generator, dtype=torch.float64) * math.pi
+    centers = torch.randint(20, (batch,), generator=generator)
+    nbr_idx = torch.randint(20, (batch, num_slots), generator=generator)
+    edge_idx = torch.randint(40, (batch, num_slots), generator=generator)
+    counts = torch.linspace(0, num_slots, batch).round().long()
+    mask = torch.arange(num_slots) < counts.unsqueeze(1)
+    return node_features, edge_features, centers, nbr_idx, edge_idx, mask
+
+
+def random_probs(batch=6, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.softmax(3 * torch.randn(batch, 8, generator=generator, dtype=torch.float64), dim=1)
+
+
+def test_sample_probs_counts_and_straight_through_gradient():
+    probs = random_probs().requires_grad_()
+    shots = torch.tensor([1, 10, 100, 1000, 10000, 100000])
+    freqs = sample_probs(probs, shots, torch.Generator().manual_seed(0))
+    # Every row is a histogram of exactly shots[b] samples
+    assert torch.allclose(freqs.sum(1), torch.ones(6, dtype=torch.float64))
+    assert torch.allclose(freqs * shots.unsqueeze(1), (freqs * shots.unsqueeze(1)).round())
+    assert (freqs[-1] - probs[-1]).abs().max() < 5e-3
+    (grad,) = torch.autograd.grad((freqs * torch.arange(8.0, dtype=torch.float64)).sum(), probs)
+    assert torch.allclose(grad, torch.arange(8.0, dtype=torch.float64).expand(6, 8))
+
+
+def test_equal_variance_allocation_saves_shots_at_uniform_variance():
+    probs = random_probs(batch=32)
+    mask = torch.ones(32, 2, dtype=torch.bool)
+    uniform = allocate_shots(1000, probs, mask, 'uniform')
+    neyman = allocate_shots(1000, probs, mask, 'equal_variance')
+    # Summed variance of the PauliZ estimates under each allocation
+    variance = (1 - (probs @ z_signs(3, probs.dtype)) ** 2).sum(1)
+    assert neyman.sum() <= uniform.sum()
+    assert (variance / neyman).sum() <= (variance / uniform).sum() * 1.01
+    # Neyman shares of the uniform total, up to per-star rounding
+    assert abs(int(allocate_shots(1000, probs, mask, 'variance').sum()) - int(uniform.sum())) <= 32
+
+
+def test_seeded_shot_readout_is_reproducible_and_unbiased():
+    stars = random_stars(2)
+    torch.manual_seed(0)
+    exact = StarCircuitLayer(w_shapes(3)).double()
+    with torch.no_grad():
+        expected = exact(*stars)
+        runs = []
+        for _ in range(2):
+            layer = StarCircuitLayer(w_shapes(3), shots=4000, shot_policy='degree', seed=7).double()
+            layer.load_state_dict(exact.state_dict())
+            runs.append(layer(*stars))
+    assert torch.equal(runs[0], runs[1])
+    # Five standard errors of a +-1 mean at the smallest per-star budget
+    shots = allocate_shots(4000, torch.zeros(12, 8), stars[-1], 'degree').min()
+    assert (runs[0] - expected).abs().max() < 5 / math.sqrt(shots)
+    assert layer.total_shots >= 12 and layer.shots_saved >= 0
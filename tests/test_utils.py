@@ -0,0 +1,79 @@
+import pytest
+import torch
+
+from utils import adjacency_csr, build_csr, graphlet_draws, plan_graphlets, sample_stars, seeded_generator
+
+
+def plan_graphlets_sequential(adjacency, num_slots, generator=None):
+    # Reference for ``plan_graphlets``: one center at a time in Python, [(center, leaves, edge ids)]
+    rowptr, col, edge_ids = (t.tolist() for t in adjacency)
+    centers, noise = graphlet_draws(len(rowptr) - 1, len(col), generator)
+    noise = noise.tolist()
+    uncovered = [True] * (len(rowptr) - 1)
+    leaf_counts = [0] * (len(rowptr) - 1)
+    stars = []
+    for center in centers.tolist():
+        entries = list(range(rowptr[center], rowptr[center + 1]))
+        if len(entries) > num_slots:
+            entries.sort(key=lambda e: (0, 0, noise[e]) if uncovered[col[e]] else (1, leaf_counts[col[e]], noise[e]))
+            entries = entries[:num_slots]
+        for e in entries:
+            uncovered[col[e]] = False
+            leaf_counts[col[e]] += 1
+        stars.append((center, [col[e] for e in entries], [edge_ids[e] for e in entries]))
+    return stars
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('num_nodes, num_edges, num_slots', [(12, 20, 2), (40, 160, 3), (200, 1200, 4)])
+def test_plan_graphlets_matches_sequential_plan(seed, num_nodes, num_edges, num_slots):
+    edge_index = torch.randint(num_nodes, (num_edges, 2), generator=torch.Generator().manual_seed(seed))
+    adjacency = adjacency_csr(edge_index, num_nodes)
+    centers, nbr_idx, edge_idx, mask = plan_graphlets(adjacency, num_slots, torch.Generator().manual_seed(seed))
+    planned = [(center, nbrs[occupied].tolist(), edges[occupied].tolist())
+               for center, nbrs, edges, occupied in zip(centers.tolist(), nbr_idx, edge_idx, mask)]
+    assert planned == plan_graphlets_sequential(adjacency, num_slots, torch.Generator().manual_seed(seed))
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('num_slots', [1, 3])
+def test_sample_stars_picks_real_distinct_edges(seed, num_slots):
+    # (E, 2) (source, destination) edges with repeated and self-loop entries
+    edge_index = torch.randint(15, (60, 2), generator=torch.Generator().manual_seed(seed))
+    csr = build_csr(edge_index)
+    centers, nbr_idx, edge_idx, mask = sample_stars(csr, num_slots, generator=torch.Generator().manual_seed(seed))
+    assert sorted(centers.tolist()) == sorted(set(edge_index[:, 1].tolist()))
+    degree = torch.bincount(edge_index[:, 1], minlength=15)
+    assert torch.equal(mask.sum(1), degree[centers].clamp(max=num_slots))
+    for center, nbrs, edges, occupied in zip(centers.tolist(), nbr_idx, edge_idx, mask):
+        edges = edges[occupied]
+        assert len(set(edges.tolist())) == len(edges)
+        assert torch.equal(edge_index[edges], torch.stack([nbrs[occupied], torch.full_like(edges, center)], dim=1))
+        if degree[center] <= num_slots:
+            # Stars that fit keep every edge, in edge order
+            assert edges.tolist() == (edge_index[:, 1] == center).nonzero().flatten().tolist()
+
+
+def test_sample_stars_draws_neighbors_uniformly():
+    # Center 0 with six neighbors and two slots: each neighbor in a third of the draws
+    edge_index = torch.stack([torch.arange(1, 7), torch.zeros(6, dtype=torch.long)], dim=1)
+    csr = build_csr(edge_index)
+    generator = torch.Generator().manual_seed(0)
+    hits = torch.zeros(7)
+    for _ in range(3000):
+        _, nbr_idx, _, _ = sample_stars(csr, 2, generator=generator)
+        hits[nbr_idx[0]] += 1
+    assert (hits[1:] / 3000 - 1 / 3).abs().max() < 0.04
+
+
+def test_seeded_generator_reproduces_star_samples():
+    edge_index = torch.randint(30, (120, 2), generator=torch.Generator().manual_seed(0))
+    csr = build_csr(edge_index)
+    assert seeded_generator(None, None, 'cpu') is None
+    generator = seeded_generator(None, 7, 'cpu')
+    assert seeded_generator(generator, 7, 'cpu') is generator
+    first = sample_stars(csr, 2, generator=generator)
+    second = sample_stars(csr, 2, generator=generator)
+    again = sample_stars(csr, 2, generator=seeded_generator(None, 7, 'cpu'))
+    assert all(torch.equal(a, b) for a, b in zip(first, again))
+    assert not all(torch.equal(a, b) for a, b in zip(first, second))